@@ -0,0 +1,143 @@
+# ai21_backend.py
+import asyncio
+import logging
+import random
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional
+
+import httpx
+from ai21 import AsyncAI21Client
+from ai21.errors import AI21ServerError, APITimeoutError, ServiceUnavailable, TooManyRequestsError
+from ai21.models.chat import ChatMessage
+
+from config import (
+    AI21_API_KEY,
+    AI21_MAX_CONCURRENCY,
+    AI21_MAX_CONNECTIONS,
+    AI21_MAX_RETRIES,
+    AI21_QUEUE_TIMEOUT,
+    AI21_RETRY_BACKOFF,
+    AI21_TIMEOUT,
+)
+
+from utils.metrics import count_tokens, stage
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, после которых имеет смысл повторить запрос
+RETRYABLE_ERRORS = (
+    asyncio.TimeoutError,
+    httpx.TransportError,
+    APITimeoutError,
+    TooManyRequestsError,
+    AI21ServerError,
+    ServiceUnavailable,
+)
+
+
+class AI21Backend:
+    """Общий асинхронный клиент AI21: пул соединений, лимит параллельных запросов, таймауты и ретраи"""
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        max_concurrency: int = AI21_MAX_CONCURRENCY,
+        max_connections: int = AI21_MAX_CONNECTIONS,
+        timeout: float = AI21_TIMEOUT,
+        max_retries: int = AI21_MAX_RETRIES,
+        retry_backoff: float = AI21_RETRY_BACKOFF,
+        queue_timeout: float = AI21_QUEUE_TIMEOUT,
+    ):
+        self.api_key = api_key or AI21_API_KEY
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._http: httpx.AsyncClient | None = None
+        self._client: AsyncAI21Client | None = None
+
+    async def start(self):
+        """Создаём клиента один раз при старте приложения"""
+        if self._client is not None:
+            return
+        self._http = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.timeout, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+            ),
+        )
+        self._client = AsyncAI21Client(api_key=self.api_key, timeout_sec=self.timeout, http_client=self._http)
+        logger.info("✅ AI21 клиент запущен")
+
+    @asynccontextmanager
+    async def _slot(self):
+        """Слот семафора; ожидание в очереди не тратит таймаут самого запроса"""
+        await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+    async def _with_retries(self, call):
+        """Вызов с таймаутом и повтором с экспоненциальной задержкой (вызывается уже внутри слота)"""
+        attempt = 0
+        while True:
+            try:
+                return await asyncio.wait_for(call(), timeout=self.timeout)
+            except RETRYABLE_ERRORS as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                delay = self.retry_backoff * (2 ** (attempt - 1)) + random.uniform(0, self.retry_backoff)
+                logger.warning(f"AI21 ошибка ({type(e).__name__}), повтор {attempt}/{self.max_retries} через {delay:.1f}с")
+                await asyncio.sleep(delay)
+
+    async def complete(self, model: str, messages: List[ChatMessage], **params):
+        """Chat completion с ограничением параллелизма, таймаутом и ретраями"""
+        if self._client is None:
+            await self.start()
+
+        with stage("ai21"):
+            async with self._slot():
+                response = await self._with_retries(
+                    lambda: self._client.chat.completions.create(model=model, messages=messages, **params)
+                )
+        count_tokens(response.usage)
+        return response
+
+    async def stream(self, model: str, messages: List[ChatMessage], **params) -> AsyncIterator[str]:
+        """Потоковый chat completion: отдаёт куски текста по мере генерации.
+        Повторяем только открытие потока; слот семафора занят до конца генерации."""
+        if self._client is None:
+            await self.start()
+
+        async with self._slot():
+            with stage("ai21_first_token"):
+                stream = await self._with_retries(
+                    lambda: self._client.chat.completions.create(model=model, messages=messages, stream=True, **params)
+                )
+            try:
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(stream.__anext__(), timeout=self.timeout)
+                    except StopAsyncIteration:
+                        break
+                    count_tokens(chunk.usage)
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            finally:
+                await stream.close()
+
+    async def close(self):
+        if self._http is not None:
+            await self._http.aclose()
+        self._http = None
+        self._client = None
+        logger.info("🛑 AI21 клиент закрыт")
+
+
+# Глобальный экземпляр, живёт всё время работы приложения
+ai21_backend = AI21Backend()
@@ -1,19 +1,33 @@
 # ai_21.py
-from ai21 import AI21Client
 from ai21.models.chat import ChatMessage
-from services.rag_system import RAGSystem
-import os, logging, re
+from services.rag_system import RAGSystem, rag_cache
+from services.fact_check import FactChecker
+from services.html_extract import shutdown_executor
+from services.text_clean import shutdown_pool
+from services.answer_cache import answer_cache
+from services.memory_store import create_memory_store, format_history
+from services.query_router import is_time_query, normalize
+from API.ai21_backend import ai21_backend
+from config import RAG_ALWAYS
+import logging, re
 from datetime import datetime
 import pytz
 
 logger = logging.getLogger(__name__)
 
+MODEL = "jamba-large"
+MAX_TOKENS = 1024
+TEMPERATURE = 0.1
+ERROR_ANSWER = "🔍 Произошла ошибка при генерации или проверке информации."
+
 # Глобальный экземпляр RAG системы
-rag_system = RAGSystem(always_enabled=True)
+rag_system = RAGSystem(always_enabled=RAG_ALWAYS)
+
+# Фактчекинг ответов через ту же RAG систему
+fact_checker = FactChecker(rag_system)
 
-# Короткая память пользователей с сущностями
-# {user_id: {"last_queries": [], "last_entities": {}}}
-user_memory = {}
+# Короткая память пользователей с сущностями (ограниченная, с сохранением на диск)
+user_memory = create_memory_store()
 
 # Функция для текущего времени в Беларуси
 def get_current_time_belarus():
@@ -21,21 +35,30 @@ def get_current_time_belarus():
     now = datetime.now(tz)
     return now.strftime("%H:%M:%S")
 
-async def ask_ai21_with_rag(messages: list, user_id: str = None, model="jamba-large", max_tokens=1024) -> str:
+async def remember_query(user_id: str, user_query: str):
+    """Запрос в память пользователя вместе с простыми сущностями (имена, места)"""
+    entity_match = re.findall(r'\b[А-ЯЁ][а-яё]+\b', user_query)
+    entities = {"имя": entity_match[-1]} if entity_match else None  # последнее упомянутое слово с заглавной
+    await user_memory.remember(user_id, user_query, entities)
+
+async def ask_ai21_with_rag(messages: list, user_id: str = None, model=MODEL, max_tokens=MAX_TOKENS,
+                            on_delta=None) -> str:
+    """Ответ модели. Если передан on_delta(text), ответ генерируется потоком
+    и колбэк получает накопленный текст после каждого куска."""
     try:
         user_msg = messages[-1]["content"] if messages else ""
+        # в память и в поиск сущностей идёт только сам вопрос, без приложенного контекста
+        user_query = user_msg.split("\n\nКонтекст:", 1)[0]
 
-        # Проверка на запрос времени
-        if any(w in user_msg.lower() for w in ["который час", "сколько сейчас", "время"]):
+        # Проверка на запрос времени: то же правило, что у маршрутизатора и кэша ответов
+        if is_time_query(normalize(user_query)):
             current_time = get_current_time_belarus()
             messages.append({"role": "system", "content": f"Текущее время в Беларуси: {current_time}"})
 
         # Загружаем память пользователя
-        last_queries = []
-        last_entities = {}
-        if user_id and user_id in user_memory:
-            last_queries = user_memory[user_id]["last_queries"][-10:]
-            last_entities = user_memory[user_id]["last_entities"]
+        record = await user_memory.get(user_id) if user_id else None
+        history = format_history(record)
+        last_entities = record.entities if record else {}
 
         # Формируем контекст для системного сообщения
         context_hint = ""
@@ -47,7 +70,8 @@ async def ask_ai21_with_rag(messages: list, user_id: str = None, model="jamba-la
 Ты интеллектуальный ассистент для пользователей в Беларуси.
 Отвечай с учётом местных реалий и актуальной информации.
 Используй только проверенные данные из интернета.
-Память пользователя (последние сообщения): {last_queries if last_queries else 'нет истории'}
+Память пользователя (последние сообщения):
+{history if history else 'нет истории'}
 {context_hint}
         """
 
@@ -56,44 +80,39 @@ async def ask_ai21_with_rag(messages: list, user_id: str = None, model="jamba-la
         chat_messages += [ChatMessage(role=m["role"], content=m["content"]) for m in messages]
 
         # Генерация ответа
-        client = AI21Client(api_key=os.getenv("AI21_API_KEY"))
-        response = client.chat.completions.create(
-            model=model,
-            messages=chat_messages,
-            max_tokens=max_tokens,
-            temperature=0.1
-        )
-        answer = response.choices[0].message.content
-
-        # Фактчекинг через RAG (только числа и даты)
-        facts = re.findall(r'\d{1,4}|\d{1,2}[./-]\d{1,2}[./-]\d{2,4}', answer)
-        verified = {}
-        for fact in facts:
-            context = await rag_system.get_relevant_context(f"{fact} Беларусь")
-            verified[fact] = "✅ подтверждено" if "не найдено" not in context.lower() else "⚠️ не подтверждено"
-
-
+        if on_delta is None:
+            response = await ai21_backend.complete(
+                model=model,
+                messages=chat_messages,
+                max_tokens=max_tokens,
+                temperature=TEMPERATURE
+            )
+            answer = response.choices[0].message.content
+        else:
+            answer = ""
+            async for delta in ai21_backend.stream(
+                model=model,
+                messages=chat_messages,
+                max_tokens=max_tokens,
+                temperature=TEMPERATURE
+            ):
+                answer += delta
+                await on_delta(answer)
 
         if user_id:
-            if user_id not in user_memory:
-                user_memory[user_id] = {"last_queries": [], "last_entities": {}}
-
-
-            user_memory[user_id]["last_queries"].append(user_msg)
-            if len(user_memory[user_id]["last_queries"]) > 10:
-                user_memory[user_id]["last_queries"].pop(0)
-
-            # Простое извлечение сущностей (например, имена, места)
-            entity_match = re.findall(r'\b[А-ЯЁ][а-яё]+\b', user_msg)
-            if entity_match:
-                user_memory[user_id]["last_entities"]["имя"] = entity_match[-1]  # последнее упомянутое слово с заглавной
+            await remember_query(user_id, user_query)
 
         return answer
 
     except Exception as e:
         logger.error(f"AI21 RAG error: {e}")
-        return "🔍 Произошла ошибка при генерации или проверке информации."
+        return ERROR_ANSWER
 
 async def close_rag_system():
+    await fact_checker.close()
     await rag_system.close()
+    await rag_cache.close()
+    await answer_cache.close()
+    shutdown_executor()
+    shutdown_pool()
 
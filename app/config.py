@@ -13,3 +13,123 @@ WEBHOOK_PATH = "/webhook/bot"
 WEBHOOK_URL = f"{WEBHOOK_HOST}{WEBHOOK_PATH}"
 
 PORT = int(os.getenv("PORT", 8080))
+
+# Свой Bot API сервер (например, локальный telegram-bot-api или заглушка в бенчмарке)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+
+# AI21 клиент
+AI21_MAX_CONCURRENCY = int(os.getenv("AI21_MAX_CONCURRENCY", 8))
+AI21_MAX_CONNECTIONS = int(os.getenv("AI21_MAX_CONNECTIONS", 16))
+AI21_TIMEOUT = float(os.getenv("AI21_TIMEOUT", 60))
+AI21_MAX_RETRIES = int(os.getenv("AI21_MAX_RETRIES", 2))
+AI21_RETRY_BACKOFF = float(os.getenv("AI21_RETRY_BACKOFF", 0.5))
+AI21_QUEUE_TIMEOUT = float(os.getenv("AI21_QUEUE_TIMEOUT", 30))  # сколько ждать свободного слота
+
+# Фактчекинг ответов: off | background | inline
+FACT_CHECK_MODE = os.getenv("FACT_CHECK_MODE", "background")
+FACT_CHECK_CONCURRENCY = int(os.getenv("FACT_CHECK_CONCURRENCY", 3))
+FACT_CHECK_BUDGET = float(os.getenv("FACT_CHECK_BUDGET", 8))
+FACT_CHECK_MAX_FACTS = int(os.getenv("FACT_CHECK_MAX_FACTS", 10))
+FACT_CHECK_CACHE_TTL = float(os.getenv("FACT_CHECK_CACHE_TTL", 3600))
+FACT_CHECK_CACHE_SIZE = int(os.getenv("FACT_CHECK_CACHE_SIZE", 1000))
+
+# Кэш RAG: лимит памяти, TTL по типам записей, необязательный SQLite-файл
+RAG_CACHE_MAX_BYTES = int(os.getenv("RAG_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+RAG_CACHE_TTL_SEARCH = float(os.getenv("RAG_CACHE_TTL_SEARCH", 1800))
+RAG_CACHE_TTL_PAGE = float(os.getenv("RAG_CACHE_TTL_PAGE", 3600))
+RAG_CACHE_TTL_CONTEXT = float(os.getenv("RAG_CACHE_TTL_CONTEXT", 900))
+RAG_CACHE_DB = os.getenv("RAG_CACHE_DB", "")
+
+# Кэш готовых ответов: лимит памяти, TTL по срочности вопроса, необязательный SQLite-файл
+ANSWER_CACHE_MAX_BYTES = int(os.getenv("ANSWER_CACHE_MAX_BYTES", 8 * 1024 * 1024))
+ANSWER_TTL_VOLATILE = float(os.getenv("ANSWER_TTL_VOLATILE", 600))    # курсы, погода, новости, "сегодня"
+ANSWER_TTL_RECENT = float(os.getenv("ANSWER_TTL_RECENT", 3600))       # "последний", "актуальный", год
+ANSWER_TTL_STABLE = float(os.getenv("ANSWER_TTL_STABLE", 6 * 3600))   # всё остальное
+ANSWER_CACHE_DB = os.getenv("ANSWER_CACHE_DB", "")
+
+# Удалённый /api/chat для раздельного деплоя (пусто - обработка в этом процессе)
+CHAT_API_URL = os.getenv("CHAT_API_URL", "")
+
+# Потоковые ответы: как часто обновлять сообщение в Telegram (секунды)
+TELEGRAM_EDIT_INTERVAL = float(os.getenv("TELEGRAM_EDIT_INTERVAL", 1.0))
+
+# Общий пул исходящих HTTP-соединений
+HTTP_LIMIT = int(os.getenv("HTTP_LIMIT", 100))
+HTTP_LIMIT_PER_HOST = int(os.getenv("HTTP_LIMIT_PER_HOST", 8))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", 300))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", 30))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 10))
+HTTP_TOTAL_TIMEOUT = float(os.getenv("HTTP_TOTAL_TIMEOUT", 30))
+
+# Загрузка страниц: сколько байт читать максимум и сколько потоков на разбор HTML
+PAGE_MAX_BYTES = int(os.getenv("PAGE_MAX_BYTES", 512 * 1024))
+PAGE_TIMEOUT = float(os.getenv("PAGE_TIMEOUT", 10))  # на всю страницу; connect/read - из HTTP_*_TIMEOUT
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", 4))
+# Очистка текста страниц: 0 - в event loop, N - в пуле из N процессов
+CLEAN_WORKERS = int(os.getenv("CLEAN_WORKERS", 0))
+# Параллельная загрузка страниц: общий дедлайн (0 - ждать все страницы), сколько хороших страниц достаточно
+# (0 - все), запасные ссылки на случай мёртвых и через сколько секунд запускать их, не дожидаясь отказа
+FETCH_DEADLINE = float(os.getenv("FETCH_DEADLINE", 4))
+FETCH_MIN_PAGES = int(os.getenv("FETCH_MIN_PAGES", 3))
+FETCH_MIN_CHARS = int(os.getenv("FETCH_MIN_CHARS", 300))  # меньше - страница не считается хорошей
+FETCH_HEDGE = int(os.getenv("FETCH_HEDGE", 2))
+FETCH_HEDGE_DELAY = float(os.getenv("FETCH_HEDGE_DELAY", 1.0))
+# Статистика доменов: медленнее DOMAIN_SLOW_AFTER секунд или с частыми ошибками качаются в последнюю очередь
+DOMAIN_SLOW_AFTER = float(os.getenv("DOMAIN_SLOW_AFTER", 2.0))
+DOMAIN_STATS_TTL = float(os.getenv("DOMAIN_STATS_TTL", 3600))
+
+# Поисковые провайдеры по порядку (google, local) и их бюджеты времени
+SEARCH_PROVIDERS = os.getenv("SEARCH_PROVIDERS", "google")
+GOOGLE_SEARCH_URL = os.getenv("GOOGLE_SEARCH_URL", "https://www.google.com/search")
+SEARCH_BUDGET_GOOGLE = float(os.getenv("SEARCH_BUDGET_GOOGLE", 5))
+SEARCH_BUDGET_LOCAL = float(os.getenv("SEARCH_BUDGET_LOCAL", 0.5))
+LOCAL_CORPUS_DIR = os.getenv("LOCAL_CORPUS_DIR", "")
+LOCAL_MIN_SCORE = float(os.getenv("LOCAL_MIN_SCORE", 1.0))
+
+# Маршрутизация запросов: какие классы обходятся без веб-поиска (small_talk, time, follow_up),
+# RAG_ALWAYS=1 - искать для всех сообщений, как раньше
+ROUTER_SKIP = [r.strip() for r in os.getenv("ROUTER_SKIP", "small_talk,time,follow_up").split(",") if r.strip()]
+ROUTER_MAX_WORDS = int(os.getenv("ROUTER_MAX_WORDS", 8))
+ROUTER_FOLLOW_UP_WINDOW = float(os.getenv("ROUTER_FOLLOW_UP_WINDOW", 600))
+RAG_ALWAYS = os.getenv("RAG_ALWAYS", "0") == "1"
+
+# Сборка контекста: бюджет токенов и размер куска страницы в символах
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 1200))
+CONTEXT_CHUNK_CHARS = int(os.getenv("CONTEXT_CHUNK_CHARS", 400))
+
+# Память пользователей: лимиты, вытеснение и необязательный SQLite-файл
+MEMORY_MAX_USERS = int(os.getenv("MEMORY_MAX_USERS", 10000))
+MEMORY_IDLE_TTL = float(os.getenv("MEMORY_IDLE_TTL", 7 * 24 * 3600))
+MEMORY_HISTORY = int(os.getenv("MEMORY_HISTORY", 10))
+MEMORY_QUERY_CHARS = int(os.getenv("MEMORY_QUERY_CHARS", 300))
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", 300))
+MEMORY_FLUSH_INTERVAL = float(os.getenv("MEMORY_FLUSH_INTERVAL", 5))
+MEMORY_DB = os.getenv("MEMORY_DB", "")
+
+# Контроль допуска /api/chat: общий лимит, очередь, лимит на пользователя, идемпотентность request_id
+CHAT_MAX_CONCURRENCY = int(os.getenv("CHAT_MAX_CONCURRENCY", 16))
+CHAT_MAX_QUEUE = int(os.getenv("CHAT_MAX_QUEUE", 32))
+CHAT_QUEUE_TIMEOUT = float(os.getenv("CHAT_QUEUE_TIMEOUT", 10))
+USER_RATE = float(os.getenv("USER_RATE", 0.2))  # запросов в секунду на пользователя
+USER_BURST = int(os.getenv("USER_BURST", 5))
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", 600))
+IDEMPOTENCY_SIZE = int(os.getenv("IDEMPOTENCY_SIZE", 1000))
+# За прокси (Render) адрес клиента берётся из последнего X-Forwarded-For; 0 - только request.remote
+TRUST_PROXY = os.getenv("TRUST_PROXY", "1") == "1"
+
+# Webhook: ответ Telegram сразу, апдейты обрабатывает пул воркеров (по порядку внутри чата)
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 8))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000))
+WEBHOOK_DEDUP_SIZE = int(os.getenv("WEBHOOK_DEDUP_SIZE", 10000))  # сколько последних update_id помнить
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", 20))
+
+# Несколько процессов на одном порту (SO_REUSEPORT), webhook ставит супервизор один раз
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", 1))
+# Упавший процесс перезапускается с задержкой 1, 2, 4... секунд (не больше WORKER_RESTART_MAX_DELAY);
+# проработавший WORKER_STABLE_AFTER секунд снова перезапускается сразу
+WORKER_RESTART_MAX_DELAY = float(os.getenv("WORKER_RESTART_MAX_DELAY", 60))
+WORKER_STABLE_AFTER = float(os.getenv("WORKER_STABLE_AFTER", 60))
+# Общее состояние процессов (память пользователей, кэши, лимиты): sqlite:///файл (в /dev/shm - в памяти)
+# или redis://host:port/db; пусто - в памяти процесса. С WEB_WORKERS > 1 по умолчанию SQLite-файл
+STATE_URL = os.getenv("STATE_URL", "sqlite:///shared_state.sqlite3" if WEB_WORKERS > 1 else "")
@@ -1,15 +1,19 @@
 from aiogram import Router, types, F
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
+import json
 import logging
-from services.rag_system import RAGSystem
-from API.ai_21 import ask_ai21_with_rag
-from aiohttp import web, ClientSession
+from API.ai_21 import ERROR_ANSWER, rag_system
+from services.admission import NotReusable, Rejected, admission
+from services.answer_cache import answer_cache
+from services.chat_service import chat_service
+from services.query_router import query_router
+from services.rag_system import rag_cache
+from utils.telegram_stream import StreamingReply
+from aiohttp import web
+from config import TRUST_PROXY
 
 logger = logging.getLogger(__name__)
 router = Router()
-rag_system = RAGSystem()
-
-API_URL = "https://ai-sber.onrender.com/api/chat"  # ваш endpoint Mini App / API
 
 # --- /mini_app ---
 @router.message(F.text & F.text.startswith("/mini_app"))
@@ -32,7 +36,7 @@ async def cmd_start(message: types.Message):
         "🚀 Или используй /mini_app для открытия Mini App"
     )
 
-# --- обычный чат с POST к API для пробуждения сервера ---
+# --- обычный чат через общий сервис чата ---
 @router.message(F.text & ~F.text.startswith("/"))
 async def handle_user_chat(message: types.Message):
     logger.info(f"Получено сообщение от {message.from_user.id}: {message.text}")
@@ -40,23 +44,43 @@ async def handle_user_chat(message: types.Message):
     # Отправляем "печатает..."
     await message.bot.send_chat_action(message.chat.id, "typing")
     
-    # POST к Mini App API
-    async with ClientSession() as session:
-        try:
-            async with session.post(API_URL, json={"user_id": message.from_user.id, "text": message.text}) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    answer = data.get("answer", "❌ Бот не смог обработать запрос.")
-                else:
-                    logger.warning(f"API вернул статус {resp.status}")
-                    answer = "❌ Ошибка API. Попробуйте позже."
-        except Exception as e:
-            logger.error(f"Ошибка при POST к API: {e}")
-            answer = "❌ Не удалось соединиться с сервером."
-
-    await message.answer(answer)
+    # Ответ приходит потоком: одно сообщение, обновляемое по мере генерации
+    reply = StreamingReply(message)
+    try:
+        result = await chat_service.answer(message.from_user.id, message.text, on_delta=reply.update)
+        answer = result["answer"]
+    except Exception as e:
+        logger.error(f"Ошибка обработки сообщения: {e}")
+        answer = "❌ Ошибка API. Попробуйте позже."
+
+    await reply.finish(answer)
 
 # --- Mini App endpoint ---
+def _rejected(e: Rejected, request_id):
+    """Быстрый отказ при перегрузке: клиент повторит после Retry-After"""
+    return web.json_response({"success": False, "error": e.reason, "request_id": request_id}, status=e.status,
+                             headers={"Retry-After": str(e.retry_after), "Access-Control-Expose-Headers": "Retry-After"})
+
+def _client_ip(request):
+    # за прокси request.remote - адрес самого прокси, общий для всех клиентов;
+    # берём последний адрес: его дописал наш прокси, остальные клиент может подставить сам
+    if TRUST_PROXY:
+        forwarded = request.headers.get("X-Forwarded-For", "").split(",")[-1].strip()
+        if forwarded:
+            return forwarded
+    return request.remote
+
+async def _answer_once(user_id, user_msg, fact_check):
+    result = await chat_service.answer_local(user_id, user_msg, fact_check=fact_check)
+    if result["answer"] == ERROR_ANSWER:
+        # повтор с тем же request_id должен попробовать ещё раз, а не получить ту же ошибку
+        raise NotReusable(result)
+    return result
+
+def _user_key(request, user_id):
+    # без user_id лимитируем по адресу клиента
+    return user_id if user_id is not None else _client_ip(request)
+
 async def handle_mini_app_request(request):
     try:
         data = await request.json()
@@ -67,24 +91,94 @@ async def handle_mini_app_request(request):
         if not user_msg:
             return web.json_response({"success": False, "error": "Missing text parameter"}, status=400)
 
-        context = await rag_system.get_relevant_context(user_msg)
-        messages = [{"role": "user", "content": f"{user_msg}\n\nКонтекст:\n{context}"}]
-        answer = await ask_ai21_with_rag(messages, user_id=str(user_id))
+        fact_check = data.get("fact_check")
+        try:
+            # одинаковые запросы пользователя в работе объединяются, повтор с тем же request_id получает готовый ответ
+            result = await admission.run(
+                _user_key(request, user_id), (user_msg.strip(), fact_check),
+                lambda: _answer_once(user_id, user_msg, fact_check),
+                request_id=request_id,
+            )
+        except Rejected as e:
+            return _rejected(e, request_id)
 
-        return web.json_response({
+        response = {
             "success": True,
-            "answer": answer,
+            "answer": result["answer"],
             "request_id": request_id
-        })
+        }
+        if "facts" in result:
+            response["facts"] = result["facts"]
+        return web.json_response(response)
     except Exception as e:
         logger.exception("Ошибка обработки запроса Mini App")
         return web.json_response({"success": False, "error": str(e)}, status=500)
 
+# --- Mini App потоковый endpoint (Server-Sent Events) ---
+def _sse(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+async def handle_mini_app_stream(request):
+    try:
+        data = await request.json()
+    except Exception:
+        return web.json_response({"success": False, "error": "Invalid JSON"}, status=400)
+    user_id = data.get("user_id")
+    user_msg = data.get("text", "")
+    request_id = data.get("request_id")
+
+    if not user_msg:
+        return web.json_response({"success": False, "error": "Missing text parameter"}, status=400)
+
+    try:
+        async with admission.slot(_user_key(request, user_id)):
+            return await _stream_answer(request, data, user_id, user_msg, request_id)
+    except Rejected as e:
+        return _rejected(e, request_id)
+
+async def _stream_answer(request, data, user_id, user_msg, request_id):
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+        'Access-Control-Allow-Origin': '*'
+    })
+    await response.prepare(request)
+
+    sent = 0
+
+    async def on_delta(text):
+        nonlocal sent
+        await response.write(_sse("delta", {"text": text[sent:]}))
+        sent = len(text)
+
+    try:
+        result = await chat_service.answer_local(user_id, user_msg, fact_check=data.get("fact_check"),
+                                                 on_delta=on_delta)
+        done = {"success": True, "answer": result["answer"], "request_id": request_id}
+        if "facts" in result:
+            done["facts"] = result["facts"]
+        await response.write(_sse("done", done))
+    except ConnectionResetError:
+        logger.info("Клиент закрыл поток до конца ответа")
+        return response
+    except Exception as e:
+        logger.exception("Ошибка потокового запроса Mini App")
+        await response.write(_sse("error", {"success": False, "error": str(e), "request_id": request_id}))
+    await response.write_eof()
+    return response
+
 def setup_web_routes(app):
     app.router.add_post('/api/chat', handle_mini_app_request)
+    app.router.add_post('/api/chat/stream', handle_mini_app_stream)
 
     async def health_check(request):
-        return web.json_response({"status": "ok"})
+        return web.json_response({"status": "ok", "cache": rag_cache.stats(), "answer_cache": answer_cache.stats(),
+                                  "admission": admission.stats(),
+                                  "router": query_router.stats(),
+                                  "domains": rag_system.web_search.domains.stats(),
+                                  "webhook": request.app["webhook_updates"].stats()
+                                  if "webhook_updates" in request.app else None})
 
     app.router.add_get('/health', health_check)
 
@@ -102,4 +196,4 @@ def setup_web_routes(app):
         return resp
 
     app.middlewares.append(cors_middleware)
-    logger.info("✅ Web routes настроены: /api/chat, /health")
+    logger.info("✅ Web routes настроены: /api/chat, /api/chat/stream, /health")
@@ -1,12 +1,26 @@
 import os
 import logging
 import asyncio
-from aiohttp import web, ClientSession
+import multiprocessing
+import signal
+import time
+from multiprocessing.connection import wait
+from aiohttp import web
 from aiogram import Bot, Dispatcher
-from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.webhook.aiohttp_server import setup_application
 from handlers import user
 from handlers.user import setup_web_routes
+from API.ai21_backend import ai21_backend
+from API.ai_21 import close_rag_system, user_memory
+from services.http_client import http_client, setup_http_client
+from services.shared_state import close_shared_state, shared_state
 from utils.logger import setup_logger
+from utils.metrics import metrics_handler, metrics_middleware, monitor_loop_lag
+from utils.update_queue import QueuedRequestHandler
+from config import (TELEGRAM_API_URL, WEB_WORKERS, WEBHOOK_DRAIN_TIMEOUT, WORKER_RESTART_MAX_DELAY,
+                    WORKER_STABLE_AFTER)
 
 logger = setup_logger()
 
@@ -28,15 +42,18 @@ async def keep_awake():
     """Пингуем себя каждые 5 минут, чтобы Render не засыпал"""
     while True:
         try:
-            async with ClientSession() as session:
-                async with session.get(WEBHOOK_HOST) as resp:
-                    logger.info(f"Keep-alive ping, status {resp.status}")
+            async with http_client.session.get(WEBHOOK_HOST) as resp:
+                logger.info(f"Keep-alive ping, status {resp.status}")
         except Exception as e:
             logger.warning(f"Keep-alive error: {e}")
         await asyncio.sleep(300)  # каждые 5 минут
 
 # ---------------- Bot Handlers ----------------
-async def on_startup(bot: Bot):
+def create_bot() -> Bot:
+    session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+    return Bot(token=BOT_TOKEN, session=session)
+
+async def setup_webhook(bot: Bot):
     info = await bot.get_webhook_info()
     logger.info(f"Webhook info: {info}")
     if info.url != WEBHOOK_URL:
@@ -49,22 +66,37 @@ async def on_startup(bot: Bot):
     else:
         logger.info(f"ℹ️ Webhook уже установлен")
 
+async def on_startup(bot: Bot):
+    await ai21_backend.start()
+    # с несколькими процессами webhook ставит и снимает супервизор
+    if WEB_WORKERS <= 1:
+        await setup_webhook(bot)
+
 async def on_shutdown(bot: Bot):
-    await bot.delete_webhook()
+    if WEB_WORKERS <= 1:
+        await bot.delete_webhook()
+        logger.info("🛑 Webhook удален")
     await bot.session.close()
-    logger.info("🛑 Webhook удален, бот остановлен")
+    await ai21_backend.close()
+    await close_rag_system()
+    await user_memory.close()
+    close_shared_state()
+    logger.info("🛑 Бот остановлен")
 
 # ---------------- Main ----------------
-def main():
-    bot = Bot(token=BOT_TOKEN)
+def create_app(worker: int = 0) -> web.Application:
+    bot = create_bot()
     dp = Dispatcher()
     dp.include_router(user.router)
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
 
-    app = web.Application()
-    webhook_handler = SimpleRequestHandler(dispatcher=dp, bot=bot)
+    app = web.Application(middlewares=[metrics_middleware])
+    setup_http_client(app)
+    # Telegram получает ответ сразу, апдейты разбирает пул воркеров; при остановке очередь дорабатывается
+    webhook_handler = QueuedRequestHandler(dispatcher=dp, bot=bot, state=shared_state)
     webhook_handler.register(app, path=WEBHOOK_PATH)
+    app["webhook_updates"] = webhook_handler.updates
 
     setup_web_routes(app)
 
@@ -78,7 +110,9 @@ def main():
             "endpoints": {
                 "webhook": WEBHOOK_PATH,
                 "api": "/api/chat",
-                "health": "/health"
+                "api_stream": "/api/chat/stream",
+                "health": "/health",
+                "metrics": "/metrics"
             }
         })
 
@@ -87,16 +121,106 @@ def main():
         app.router.add_get('/health', health_check)
     if not any(r.resource.get_info().get("path") == "/" for r in app.router.routes()):
         app.router.add_get('/', root_handler)
+    app.router.add_get('/metrics', metrics_handler)
 
     setup_application(app, dp, bot=bot)
 
     # ---------------- Запуск Keep-Alive ----------------
-    loop = asyncio.get_event_loop()
-    loop.create_task(keep_awake())
+    # web.run_app создаёт свой event loop, поэтому задачу запускаем из жизненного цикла приложения
+    async def start_keep_awake(app):
+        # пингует себя один процесс из всех
+        app["keep_awake"] = asyncio.create_task(keep_awake()) if worker == 0 else None
+        app["loop_lag"] = asyncio.create_task(monitor_loop_lag())
+
+    async def stop_keep_awake(app):
+        if app["keep_awake"] is not None:
+            app["keep_awake"].cancel()
+        app["loop_lag"].cancel()
+
+    app.on_startup.append(start_keep_awake)
+    app.on_cleanup.insert(0, stop_keep_awake)
+    return app
+
+# ---------------- Несколько процессов ----------------
+def run_worker(worker: int):
+    # свой process group: Ctrl+C из терминала получает только супервизор и останавливает процессы сам
+    os.setpgrp()
+    logger.info(f"🚀 Процесс {worker} (pid {os.getpid()}) на порту {PORT}")
+    web.run_app(create_app(worker), host="0.0.0.0", port=PORT, reuse_port=True, print=None)
+
+async def manage_webhook(action):
+    bot = create_bot()
+    try:
+        await action(bot)
+    finally:
+        await bot.session.close()
+
+def run_supervisor(workers: int):
+    """
+    Префорк: workers процессов слушают один порт (SO_REUSEPORT), упавшие перезапускаются
+    с растущей задержкой, чтобы процесс, падающий при старте, не перезапускался раз в секунду.
+    Webhook ставится один раз до запуска процессов и снимается после их остановки.
+    """
+    asyncio.run(manage_webhook(setup_webhook))
+    # spawn, а не fork: каждый процесс открывает свои соединения и пулы
+    ctx = multiprocessing.get_context("spawn")
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    def start(worker: int):
+        process = ctx.Process(target=run_worker, args=(worker,), name=f"worker-{worker}")
+        process.start()
+        return process
+
+    processes = {i: start(i) for i in range(workers)}
+    started = {i: time.monotonic() for i in range(workers)}
+    failures = {i: 0 for i in range(workers)}
+    restart_at = {}  # {процесс: когда перезапустить}
+    while not stopping:
+        alive = [p.sentinel for i, p in processes.items() if i not in restart_at]
+        wait(alive, timeout=1)
+        now = time.monotonic()
+        for i, process in processes.items():
+            if stopping:
+                break
+            if i in restart_at:
+                if now >= restart_at[i]:
+                    del restart_at[i]
+                    processes[i] = start(i)
+                    started[i] = now
+            elif not process.is_alive():
+                # долго проработавший процесс перезапускаем сразу, падающий раз за разом - всё реже
+                failures[i] = 0 if now - started[i] >= WORKER_STABLE_AFTER else failures[i] + 1
+                delay = min(WORKER_RESTART_MAX_DELAY, 2 ** (failures[i] - 1)) if failures[i] else 0
+                logger.warning(f"Процесс {i} завершился с кодом {process.exitcode}, "
+                               f"перезапуск через {delay:.0f} с")
+                restart_at[i] = now + delay
+
+    logger.info("🛑 Останавливаю процессы")
+    for process in processes.values():
+        if process.is_alive():
+            os.kill(process.pid, signal.SIGTERM)
+    for process in processes.values():
+        process.join(timeout=WEBHOOK_DRAIN_TIMEOUT + 10)
+        if process.is_alive():
+            process.kill()
+    asyncio.run(manage_webhook(lambda bot: bot.delete_webhook()))
+    logger.info("🛑 Webhook удален, бот остановлен")
 
-    logger.info(f"🚀 Запуск бота на порту {PORT}")
+def main():
     logger.info(f"📡 Webhook URL: {WEBHOOK_URL}")
-    web.run_app(app, host="0.0.0.0", port=PORT)
+    if WEB_WORKERS > 1:
+        logger.info(f"🚀 Запуск {WEB_WORKERS} процессов на порту {PORT}")
+        run_supervisor(WEB_WORKERS)
+        return
+    logger.info(f"🚀 Запуск бота на порту {PORT}")
+    web.run_app(create_app(), host="0.0.0.0", port=PORT)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,251 @@
+import asyncio
+import json
+import logging
+import math
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from config import (
+    CHAT_MAX_CONCURRENCY,
+    CHAT_MAX_QUEUE,
+    CHAT_QUEUE_TIMEOUT,
+    IDEMPOTENCY_SIZE,
+    IDEMPOTENCY_TTL,
+    USER_BURST,
+    USER_RATE,
+)
+from services.shared_state import shared_state
+from utils.coalesce import SharedTasks
+from utils.metrics import ADMISSION_EVENTS, ADMISSION_QUEUE
+
+logger = logging.getLogger(__name__)
+
+
+class Rejected(Exception):
+    """Запрос не допущен: status 429 (лимит пользователя) или 503 (перегрузка)"""
+
+    def __init__(self, status: int, retry_after: float, reason: str):
+        super().__init__(reason)
+        self.status = status
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.reason = reason
+
+
+class NotReusable(Exception):
+    """Результат (например, сообщение об ошибке) отдаём ждущим, но не запоминаем для повторов по request_id"""
+
+    def __init__(self, value: Any):
+        super().__init__("результат не запоминается")
+        self.value = value
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class RateLimiter:
+    """
+    Token bucket на пользователя: burst запросов сразу, дальше rate в секунду.
+    Полные корзины не нужны (новая будет такой же), поэтому давно не тронутые удаляются.
+    """
+
+    def __init__(self, rate: float = USER_RATE, burst: int = USER_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    async def take(self, key: Hashable) -> float:
+        """0, если запрос разрешён, иначе через сколько секунд появится токен"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self._prune(now)
+        bucket = self._buckets.pop(key, None) or TokenBucket(self.burst, now)
+        bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+        bucket.updated = now
+        self._buckets[key] = bucket
+        if bucket.tokens < 1:
+            return (1 - bucket.tokens) / self.rate
+        bucket.tokens -= 1
+        return 0.0
+
+    def _prune(self, now: float):
+        full_after = self.burst / self.rate
+        while self._buckets:
+            bucket = next(iter(self._buckets.values()))
+            if now - bucket.updated < full_after:
+                break
+            self._buckets.popitem(last=False)
+
+
+class SharedRateLimiter:
+    """
+    Лимит на пользователя, общий для всех процессов (SharedState).
+    Вместо token bucket - счётчик в окне burst / rate секунд: не больше burst запросов за окно,
+    в среднем те же rate запросов в секунду.
+    """
+
+    def __init__(self, state, rate: float = USER_RATE, burst: int = USER_BURST):
+        self.state = state
+        self.rate = rate
+        self.burst = burst
+
+    async def take(self, key: Hashable) -> float:
+        if self.rate <= 0:
+            return 0.0
+        try:
+            count, window_left = await self.state.incr("rate", str(key), self.burst / self.rate)
+        except Exception as e:
+            # без общего хранилища не блокируем пользователей
+            logger.warning(f"Ошибка общего лимита запросов: {e}")
+            return 0.0
+        return window_left if count > self.burst else 0.0
+
+
+class AdmissionController:
+    """
+    Допуск запросов к конвейеру чата:
+    - лимит на пользователя (token bucket) -> 429;
+    - не больше max_concurrency запросов в работе и max_queue в ожидании -> 503;
+    - одинаковые запросы пользователя в работе объединяются в один;
+    - повтор с тем же request_id получает уже готовый ответ.
+    Лимиты параллельности и очереди действуют в каждом процессе; с общим state лимит пользователя
+    и готовые ответы по request_id общие для всех процессов.
+    """
+
+    def __init__(self, max_concurrency: int = CHAT_MAX_CONCURRENCY, max_queue: int = CHAT_MAX_QUEUE,
+                 queue_timeout: float = CHAT_QUEUE_TIMEOUT, limiter: Optional[RateLimiter] = None,
+                 idempotency_ttl: float = IDEMPOTENCY_TTL, idempotency_size: int = IDEMPOTENCY_SIZE,
+                 state=None):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.state = state
+        if limiter is None:
+            limiter = SharedRateLimiter(state) if state is not None else RateLimiter()
+        self.limiter = limiter
+        self.idempotency_ttl = idempotency_ttl
+        self.idempotency_size = idempotency_size
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._active = 0
+        self._waiting = 0
+        self._avg_duration = 5.0  # сглаженное время обработки, для Retry-After
+        self._inflight = SharedTasks()
+        self._done: "OrderedDict[Tuple, Tuple[float, Any]]" = OrderedDict()
+
+    def _retry_after(self) -> float:
+        # примерно когда освободится место: очередь перед нами, делённая на параллельность
+        return self._avg_duration * (self._waiting + 1) / self.max_concurrency
+
+    @asynccontextmanager
+    async def slot(self, user_key: Hashable):
+        """Лимит пользователя и место в общем пуле на время обработки"""
+        wait = await self.limiter.take(user_key)
+        if wait > 0:
+            ADMISSION_EVENTS.inc(outcome="rate_limited")
+            raise Rejected(429, wait, "Слишком много запросов, попробуйте позже")
+
+        if self._semaphore.locked():
+            if self._waiting >= self.max_queue:
+                ADMISSION_EVENTS.inc(outcome="overloaded")
+                raise Rejected(503, self._retry_after(), "Сервер перегружен, попробуйте позже")
+            self._waiting += 1
+            ADMISSION_QUEUE.set(self._waiting)
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                ADMISSION_EVENTS.inc(outcome="queue_timeout")
+                raise Rejected(503, self._retry_after(), "Сервер перегружен, попробуйте позже") from None
+            finally:
+                self._waiting -= 1
+                ADMISSION_QUEUE.set(self._waiting)
+        else:
+            await self._semaphore.acquire()
+
+        ADMISSION_EVENTS.inc(outcome="admitted")
+        self._active += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._active -= 1
+            self._semaphore.release()
+            self._avg_duration = 0.9 * self._avg_duration + 0.1 * (time.monotonic() - started)
+
+    async def run(self, user_key: Hashable, dedup_key: Hashable, fn: Callable[[], Awaitable[Any]],
+                  request_id: Optional[str] = None) -> Any:
+        """fn() под контролем допуска; повторы и дубли получают общий результат (кроме NotReusable)"""
+        done_key = (user_key, request_id) if request_id else None
+        if done_key is not None:
+            cached = await self._get_done(done_key)
+            if cached is not None:
+                ADMISSION_EVENTS.inc(outcome="idempotent")
+                return cached
+
+        item = (user_key, dedup_key)
+        if item in self._inflight:
+            ADMISSION_EVENTS.inc(outcome="coalesced")
+        # отдельная задача: отключение первого клиента не отменяет ответ для остальных одинаковых запросов
+        return await self._inflight.run(item, lambda: self._run(user_key, fn, done_key))
+
+    async def _run(self, user_key: Hashable, fn: Callable[[], Awaitable[Any]], done_key: Optional[Tuple]) -> Any:
+        async with self.slot(user_key):
+            try:
+                value = await fn()
+            except NotReusable as e:
+                return e.value
+        if done_key is not None:
+            await self._put_done(done_key, value)
+        return value
+
+    async def _get_done(self, key: Tuple) -> Any:
+        if self.state is not None:
+            try:
+                stored = await self.state.get("idempotency", json.dumps(key, default=str))
+            except Exception as e:
+                logger.warning(f"Ошибка чтения готового ответа: {e}")
+                return None
+            return None if stored is None else stored[1]
+        entry = self._done.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._done[key]
+            return None
+        return value
+
+    async def _put_done(self, key: Tuple, value: Any):
+        if self.state is not None:
+            try:
+                await self.state.set("idempotency", json.dumps(key, default=str), self.idempotency_ttl, value)
+            except Exception as e:
+                logger.warning(f"Ошибка записи готового ответа: {e}")
+            return
+        now = time.monotonic()
+        self._done[key] = (now + self.idempotency_ttl, value)
+        self._done.move_to_end(key)
+        while self._done and (len(self._done) > self.idempotency_size or next(iter(self._done.values()))[0] < now):
+            self._done.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self._active,
+            "waiting": self._waiting,
+            "users_limited": len(self.limiter) if isinstance(self.limiter, RateLimiter) else None,
+            "inflight": len(self._inflight),
+            "remembered": len(self._done),
+        }
+
+
+# Общий контроль допуска для /api/chat и /api/chat/stream
+admission = AdmissionController(state=shared_state)
@@ -0,0 +1,110 @@
+import hashlib
+import logging
+import re
+from datetime import date
+from typing import Awaitable, Callable, Optional, Tuple
+
+from config import (
+    ANSWER_CACHE_DB,
+    ANSWER_CACHE_MAX_BYTES,
+    ANSWER_TTL_RECENT,
+    ANSWER_TTL_STABLE,
+    ANSWER_TTL_VOLATILE,
+)
+from services.cache import ResultCache, SharedCacheBackend, SQLiteCacheBackend
+from services.query_router import is_time_query, normalize
+from services.shared_state import shared_state
+
+logger = logging.getLogger(__name__)
+
+# ответ зависит от того, кто спрашивает - такие вопросы не кэшируем
+_PERSONAL_RE = re.compile(
+    r'\b(я|мне|меня|мной|мой|моя|мое|мои|моих|моем|моей|нам|нас|наш|наша|наши|'
+    r'ты|тебя|тебе|помнишь|запомни|напомни)\b'
+)
+# ответ зависит от момента, а не от дня
+_MOMENT_RE = re.compile(r'\b(сейчас|прямо сейчас|в данный момент|сию минуту)\b')
+# относительные даты: ключ дополняется сегодняшней датой
+_RELATIVE_DAY_RE = re.compile(r'\b(сегодня|сегодняшн\w*|завтра|завтрашн\w*|вчера|вчерашн\w*)\b')
+_VOLATILE_RE = re.compile(r'(курс|погод|новост|цен[аыу]|стоимост|пробк|матч|котировк|бирж)')
+_RECENT_RE = re.compile(r'(последн|актуальн|текущ|недавн|\b20\d\d\b)')
+# из ключа выпадают только вежливые слова и обращения: предлоги, отрицание и вопросительные слова
+# меняют смысл ("из Минска до Бреста" и "до Минска из Бреста" - разные вопросы)
+_KEY_STOP_WORDS = {"пожалуйста", "скажи", "скажите", "подскажи", "подскажите", "бот", "ну", "а"}
+
+
+class NotCacheable(Exception):
+    """Ответ нельзя класть в кэш (например, сообщение об ошибке), но вернуть его нужно"""
+
+    def __init__(self, answer: str):
+        super().__init__("ответ не кэшируется")
+        self.answer = answer
+
+
+class AnswerCache:
+    """
+    Кэш готовых ответов модели на популярные вопросы.
+    Ключ - значимые слова вопроса (как для поискового запроса) и параметры модели,
+    TTL зависит от того, насколько быстро устаревает ответ.
+    """
+
+    def __init__(self, cache: ResultCache, ttl_volatile: float = ANSWER_TTL_VOLATILE,
+                 ttl_recent: float = ANSWER_TTL_RECENT, ttl_stable: float = ANSWER_TTL_STABLE):
+        self.cache = cache
+        self.ttl_volatile = ttl_volatile
+        self.ttl_recent = ttl_recent
+        self.ttl_stable = ttl_stable
+
+    def key(self, text: str, **params) -> Optional[str]:
+        """Ключ кэша или None, если вопрос личный или про текущий момент"""
+        query = normalize(text)
+        if not query or _PERSONAL_RE.search(query) or _MOMENT_RE.search(query) or is_time_query(query):
+            return None
+        words = [w for w in query.split() if w not in _KEY_STOP_WORDS] or query.split()
+        parts = [" ".join(words)] + [f"{k}={params[k]}" for k in sorted(params)]
+        if _RELATIVE_DAY_RE.search(query):
+            parts.append(date.today().isoformat())
+        return hashlib.md5("|".join(parts).encode("utf-8")).hexdigest()
+
+    def ttl(self, text: str) -> float:
+        query = normalize(text)
+        if _VOLATILE_RE.search(query) or _RELATIVE_DAY_RE.search(query):
+            return self.ttl_volatile
+        if _RECENT_RE.search(query):
+            return self.ttl_recent
+        return self.ttl_stable
+
+    async def get_or_generate(self, key: str, text: str,
+                              generate: Callable[[], Awaitable[str]]) -> Tuple[str, bool]:
+        """(ответ, взят ли он готовым); одинаковые вопросы в работе генерируются один раз"""
+        produced = False
+
+        async def fetch():
+            nonlocal produced
+            produced = True
+            return await generate()
+
+        try:
+            answer = await self.cache.get_or_fetch("answer", key, fetch, ttl=self.ttl(text))
+        except NotCacheable as e:
+            answer = e.answer
+        return answer, not produced
+
+    def stats(self):
+        return self.cache.stats()
+
+    async def close(self):
+        await self.cache.close()
+
+
+def create_answer_cache() -> AnswerCache:
+    if shared_state is not None:
+        backend = SharedCacheBackend(shared_state)
+    else:
+        backend = SQLiteCacheBackend(ANSWER_CACHE_DB) if ANSWER_CACHE_DB else None
+    cache = ResultCache(max_bytes=ANSWER_CACHE_MAX_BYTES, ttls={"answer": ANSWER_TTL_STABLE},
+                        backend=backend, name="answer")
+    return AnswerCache(cache)
+
+
+answer_cache = create_answer_cache()
@@ -0,0 +1,205 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from utils.coalesce import SharedTasks
+from utils.metrics import CACHE_EVENTS
+
+logger = logging.getLogger(__name__)
+
+
+def _sizeof(value: Any) -> int:
+    """Грубая оценка размера значения в байтах"""
+    if isinstance(value, str):
+        return len(value) * 2 + 64
+    if isinstance(value, (list, tuple)):
+        return sum(_sizeof(v) for v in value) + 64
+    if isinstance(value, dict):
+        return sum(_sizeof(k) + _sizeof(v) for k, v in value.items()) + 64
+    return 64
+
+
+class SQLiteCacheBackend:
+    """
+    Дисковое хранилище кэша, чтобы перезапуск не обнулял кэш.
+    Просроченные записи удаляются раз в prune_every записей, а не при каждой.
+    """
+
+    def __init__(self, path: str, prune_every: int = 100):
+        self.path = path
+        self.prune_every = prune_every
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "namespace TEXT, key TEXT, expires REAL, value TEXT, PRIMARY KEY (namespace, key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)")
+        self._conn.commit()
+        self._lock = asyncio.Lock()
+
+    def _get(self, namespace: str, key: str):
+        row = self._conn.execute(
+            "SELECT expires, value FROM cache WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        if row is None:
+            return None
+        # на диске храним wall-clock время, в памяти - monotonic
+        if row[0] < time.time():
+            return None
+        return row[0] - time.time(), json.loads(row[1])
+
+    def _set(self, namespace: str, key: str, ttl: float, value: Any):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO cache (namespace, key, expires, value) VALUES (?, ?, ?, ?)",
+            (namespace, key, time.time() + ttl, json.dumps(value, ensure_ascii=False)),
+        )
+        self._maybe_prune()
+        self._conn.commit()
+
+    def _maybe_prune(self):
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            self._conn.execute("DELETE FROM cache WHERE expires < ?", (time.time(),))
+
+    async def get(self, namespace: str, key: str):
+        async with self._lock:
+            return await asyncio.to_thread(self._get, namespace, key)
+
+    async def set(self, namespace: str, key: str, ttl: float, value: Any):
+        async with self._lock:
+            await asyncio.to_thread(self._set, namespace, key, ttl, value)
+
+    def close(self):
+        self._conn.close()
+
+
+class SharedCacheBackend:
+    """Общее состояние процессов (SharedState) в роли backend; закрывает его не кэш, а приложение"""
+
+    def __init__(self, state):
+        self.state = state
+
+    async def get(self, namespace: str, key: str):
+        return await self.state.get(namespace, key)
+
+    async def set(self, namespace: str, key: str, ttl: float, value: Any):
+        await self.state.set(namespace, key, ttl, value)
+
+    def close(self):
+        pass
+
+
+class ResultCache:
+    """
+    Кэш результатов по пространствам имён (search, page, context):
+    TTL, лимит памяти с LRU-вытеснением, склейка одновременных одинаковых запросов
+    и необязательный дисковый backend.
+    """
+
+    def __init__(self, max_bytes: int, ttls: Dict[str, float], backend: Optional[SQLiteCacheBackend] = None,
+                 name: str = "rag"):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.ttls = ttls
+        self.backend = backend
+        self._data: "OrderedDict[tuple, tuple]" = OrderedDict()  # {(ns, key): (expires, value, size)}
+        self._bytes = 0
+        self._inflight = SharedTasks()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, namespace: str, name: str):
+        ns = self._stats.setdefault(namespace, {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0})
+        ns[name] += 1
+        CACHE_EVENTS.inc(cache=self.name, namespace=namespace, event=name)
+
+    def _get_memory(self, item: tuple):
+        entry = self._data.get(item)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self._remove(item)
+            return None
+        self._data.move_to_end(item)
+        return entry
+
+    def _put_memory(self, item: tuple, ttl: float, value: Any):
+        size = _sizeof(value)
+        if size > self.max_bytes:
+            return
+        if item in self._data:
+            self._remove(item)
+        self._data[item] = (time.monotonic() + ttl, value, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            old, _ = next(iter(self._data.items()))
+            self._remove(old)
+            self._count(old[0], "evictions")
+
+    def _remove(self, item: tuple):
+        entry = self._data.pop(item, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    async def get(self, namespace: str, key: str) -> Optional[Any]:
+        item = (namespace, key)
+        entry = self._get_memory(item)
+        if entry is not None:
+            return entry[1]
+        if self.backend is not None:
+            try:
+                stored = await self.backend.get(namespace, key)
+            except Exception as e:
+                logger.warning(f"Ошибка чтения кэша с диска: {e}")
+                stored = None
+            if stored is not None:
+                ttl, value = stored
+                self._put_memory(item, ttl, value)
+                return value
+        return None
+
+    async def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        ttl = ttl if ttl is not None else self.ttls.get(namespace, 600)
+        self._put_memory((namespace, key), ttl, value)
+        if self.backend is not None:
+            try:
+                await self.backend.set(namespace, key, ttl, value)
+            except Exception as e:
+                logger.warning(f"Ошибка записи кэша на диск: {e}")
+
+    async def get_or_fetch(self, namespace: str, key: str, fetch: Callable[[], Awaitable[Any]],
+                           ttl: Optional[float] = None) -> Any:
+        """Значение из кэша или один общий fetch для всех одновременных запросов с тем же ключом"""
+        item = (namespace, key)
+        value = await self.get(namespace, key)
+        if value is not None:
+            self._count(namespace, "hits")
+            return value
+
+        # fetch идёт отдельной задачей: отмена того, кто её начал, не отменяет её для остальных ждущих
+        self._count(namespace, "coalesced" if item in self._inflight else "misses")
+        return await self._inflight.run(item, lambda: self._fetch(namespace, key, fetch, ttl))
+
+    async def _fetch(self, namespace: str, key: str, fetch: Callable[[], Awaitable[Any]], ttl: Optional[float]):
+        value = await fetch()
+        # пустые результаты (ошибки загрузки) не кэшируем
+        if value:
+            await self.set(namespace, key, value, ttl)
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        namespaces = {}
+        for ns, counters in self._stats.items():
+            lookups = counters["hits"] + counters["misses"]
+            namespaces[ns] = dict(counters, hit_ratio=round(counters["hits"] / lookups, 3) if lookups else 0.0)
+        return {"entries": len(self._data), "bytes": self._bytes, "max_bytes": self.max_bytes, "namespaces": namespaces}
+
+    async def close(self):
+        if self.backend is not None:
+            self.backend.close()
+            self.backend = None
@@ -0,0 +1,138 @@
+import logging
+from typing import Any, Dict, Optional
+
+import aiohttp
+
+from API.ai_21 import (
+    ERROR_ANSWER,
+    MAX_TOKENS,
+    MODEL,
+    TEMPERATURE,
+    ask_ai21_with_rag,
+    fact_checker,
+    rag_system,
+    remember_query,
+    user_memory,
+)
+from config import CHAT_API_URL
+from services.answer_cache import NotCacheable, answer_cache
+from services.http_client import http_client
+from services.query_router import FOLLOW_UP, RETRIEVE, SMALL_TALK, TIME, query_router
+
+logger = logging.getLogger(__name__)
+
+
+def _detached(on_delta):
+    """Колбэк одного вызывающего для общей генерации: его ошибка (клиент отключился) не портит общий ответ"""
+    if on_delta is None:
+        return None
+    failed = False
+
+    async def deliver(text: str):
+        nonlocal failed
+        if failed:
+            return
+        try:
+            await on_delta(text)
+        except Exception as e:
+            failed = True
+            logger.info(f"Потоковая выдача прервана, ответ генерируется дальше: {e}")
+
+    return deliver
+
+
+class ChatService:
+    """
+    Общий конвейер чата для Telegram и Mini App.
+    По умолчанию работает в этом же процессе; если задан CHAT_API_URL,
+    запросы уходят на удалённый /api/chat через общий пул соединений.
+    """
+
+    def __init__(self, remote_url: str = CHAT_API_URL):
+        self.remote_url = remote_url
+        self.timeout = aiohttp.ClientTimeout(total=120)
+
+    async def answer(self, user_id, text: str, fact_check: Optional[str] = None, on_delta=None) -> Dict[str, Any]:
+        """on_delta(text) - колбэк для потоковой выдачи; в удалённом режиме вызывается один раз с полным ответом"""
+        if self.remote_url:
+            result = await self._answer_remote(user_id, text, fact_check)
+            if on_delta is not None:
+                await on_delta(result["answer"])
+            return result
+        return await self.answer_local(user_id, text, fact_check, on_delta=on_delta)
+
+    async def answer_local(self, user_id, text: str, fact_check: Optional[str] = None,
+                           on_delta=None) -> Dict[str, Any]:
+        route = await self._route(user_id, text)
+        # готовые ответы только для самостоятельных вопросов: без истории, не личных и не про текущий момент
+        key = answer_cache.key(text, model=MODEL, max_tokens=MAX_TOKENS, temperature=TEMPERATURE) \
+            if route == RETRIEVE else None
+        if key is None:
+            answer = await self._generate(user_id, text, route, on_delta)
+            cached = False
+        else:
+            # общий ответ генерируется без памяти того, кто спросил первым, и идёт ему потоком;
+            # готовый ответ и ответ, которого дождались вместе с первым, приходят целиком
+            answer, cached = await answer_cache.get_or_generate(
+                key, text, lambda: self._generate(user_id, text, route, _detached(on_delta), cacheable=True)
+            )
+            await remember_query(str(user_id), text)
+            if cached and on_delta is not None:
+                await on_delta(answer)
+
+        # Фактчекинг: off | background | inline (вердикты в ответе); в приветствиях и времени проверять нечего,
+        # готовый ответ в фоне уже проверялся
+        result = {"answer": answer}
+        if route in (SMALL_TALK, TIME) or (cached and fact_check != "inline"):
+            fact_check = "off"
+        facts = await fact_checker.run(answer, mode=fact_check)
+        if facts is not None:
+            result["facts"] = facts
+        return result
+
+    async def _generate(self, user_id, text: str, route: str, on_delta=None, cacheable: bool = False) -> str:
+        context = await self._context(user_id, text, route)
+        content = f"{text}\n\nКонтекст:\n{context}" if context else text
+        messages = [{"role": "user", "content": content}]
+        if not cacheable:
+            return await ask_ai21_with_rag(messages, user_id=str(user_id), on_delta=on_delta)
+        answer = await ask_ai21_with_rag(messages, on_delta=on_delta)
+        if answer == ERROR_ANSWER:
+            raise NotCacheable(answer)
+        return answer
+
+    async def _route(self, user_id, text: str) -> str:
+        if rag_system.always_enabled:
+            return RETRIEVE
+        record = await user_memory.get(str(user_id)) if user_id is not None else None
+        return query_router.route(text, record)
+
+    async def _context(self, user_id, text: str, route: str) -> Optional[str]:
+        """Контекст для промпта: поиск только для retrieve, уточнению достаётся контекст прошлого вопроса из кэша"""
+        if route == RETRIEVE:
+            return await rag_system.get_relevant_context(text)
+        if route == FOLLOW_UP:
+            record = await user_memory.get(str(user_id))
+            for query in reversed(record.queries if record else ()):
+                context = await rag_system.get_cached_context(query)
+                if context:
+                    return context
+        return None
+
+    async def _answer_remote(self, user_id, text: str, fact_check: Optional[str] = None) -> Dict[str, Any]:
+        payload = {"user_id": user_id, "text": text}
+        if fact_check:
+            payload["fact_check"] = fact_check
+        async with http_client.session.post(self.remote_url, json=payload, timeout=self.timeout) as resp:
+            if resp.status != 200:
+                logger.warning(f"API вернул статус {resp.status}")
+                raise RuntimeError(f"API status {resp.status}")
+            data = await resp.json()
+        result = {"answer": data.get("answer", "❌ Бот не смог обработать запрос.")}
+        if "facts" in data:
+            result["facts"] = data["facts"]
+        return result
+
+
+# Глобальный экземпляр для обработчиков
+chat_service = ChatService()
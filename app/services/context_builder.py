@@ -0,0 +1,125 @@
+import logging
+import re
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from config import CONTEXT_CHUNK_CHARS, CONTEXT_TOKEN_BUDGET
+from services.search_providers import tokenize
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_RE = re.compile(r'(?<=[.!?…])\s+')
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов: для кириллицы около 3 символов на токен"""
+    return len(text) // 3 + 1
+
+
+def _terms(text: str) -> List[str]:
+    """Токены с обрезкой до 5 символов - дешёвая замена стемминга для русских окончаний"""
+    return [t[:5] for t in tokenize(text)]
+
+
+def _similar(a: set, b: set, threshold: float) -> bool:
+    if not a or not b:
+        return False
+    return len(a & b) / len(a | b) >= threshold
+
+
+class ContextBuilder:
+    """
+    Сборка контекста по релевантности: страницы режутся на куски,
+    куски оцениваются BM25 по запросу (векторно через NumPy), почти одинаковые
+    отбрасываются, лучшие жадно набираются в бюджет токенов.
+    """
+
+    def __init__(self, token_budget: int = CONTEXT_TOKEN_BUDGET, chunk_chars: int = CONTEXT_CHUNK_CHARS,
+                 dedup_threshold: float = 0.8, k1: float = 1.5, b: float = 0.75):
+        self.token_budget = token_budget
+        self.chunk_chars = chunk_chars
+        self.dedup_threshold = dedup_threshold
+        self.k1 = k1
+        self.b = b
+
+    def split_chunks(self, text: str) -> List[str]:
+        """Куски примерно по chunk_chars символов по границам предложений"""
+        chunks, current = [], ""
+        for sentence in _SENTENCE_RE.split(text):
+            if current and len(current) + len(sentence) + 1 > self.chunk_chars:
+                chunks.append(current)
+                current = ""
+            current = f"{current} {sentence}" if current else sentence
+            while len(current) > self.chunk_chars * 2:
+                chunks.append(current[:self.chunk_chars])
+                current = current[self.chunk_chars:]
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def score(self, chunks: List[str], query: str) -> np.ndarray:
+        """BM25 каждого куска по терминам запроса"""
+        q_terms = list(dict.fromkeys(_terms(query)))
+        if not chunks or not q_terms:
+            return np.zeros(len(chunks))
+
+        tf = np.zeros((len(chunks), len(q_terms)))
+        lengths = np.empty(len(chunks))
+        for row, chunk in enumerate(chunks):
+            terms = _terms(chunk)
+            counts = Counter(terms)
+            tf[row] = [counts.get(t, 0) for t in q_terms]
+            lengths[row] = len(terms)
+
+        n = len(chunks)
+        df = np.count_nonzero(tf, axis=0)
+        idf = np.log1p((n - df + 0.5) / (df + 0.5))
+        norm = self.k1 * (1 - self.b + self.b * lengths / max(lengths.mean(), 1.0))
+        return (tf * (self.k1 + 1) / (tf + norm[:, None])) @ idf
+
+    def select(self, results: List[Dict], query: str,
+               clean: Optional[Callable[[str], str]] = None) -> Dict[int, List[str]]:
+        """{номер источника: [выбранные куски в порядке текста]}"""
+        chunks, origin = [], []
+        for i, r in enumerate(results, 1):
+            content = r.get('content') or ""
+            if len(content) <= 50:
+                continue
+            if clean is not None:
+                content = clean(content)
+            for pos, chunk in enumerate(self.split_chunks(content)):
+                chunks.append(chunk)
+                origin.append((i, pos))
+        if not chunks:
+            return {}
+
+        scores = self.score(chunks, query)
+        # при равных оценках выше источник из начала выдачи
+        positions = np.array(origin)
+        order = np.lexsort((positions[:, 1], positions[:, 0], -scores))
+
+        # куски без совпадений с запросом берём, только если совпадений нет вообще
+        has_matches = bool(scores.max() > 0)
+
+        selected, taken_terms = [], []
+        remaining = self.token_budget
+        for idx in order:
+            if has_matches and scores[idx] <= 0:
+                break
+            chunk = chunks[idx]
+            cost = estimate_tokens(chunk)
+            if cost > remaining:
+                continue
+            terms = set(_terms(chunk))
+            if any(_similar(terms, t, self.dedup_threshold) for t in taken_terms):
+                continue
+            selected.append(idx)
+            taken_terms.append(terms)
+            remaining -= cost
+
+        by_source: Dict[int, List[str]] = {}
+        for idx in sorted(selected, key=lambda i: origin[i]):
+            by_source.setdefault(origin[idx][0], []).append(chunks[idx])
+        return by_source
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import re
+import time
+from typing import Dict, List, Optional
+
+from utils.metrics import stage
+from config import (
+    FACT_CHECK_BUDGET,
+    FACT_CHECK_CACHE_SIZE,
+    FACT_CHECK_CACHE_TTL,
+    FACT_CHECK_CONCURRENCY,
+    FACT_CHECK_MAX_FACTS,
+    FACT_CHECK_MODE,
+)
+
+logger = logging.getLogger(__name__)
+
+# Даты проверяем раньше чисел, иначе "12.05.2024" распадётся на три числа
+FACT_RE = re.compile(r'\d{1,2}[./-]\d{1,2}[./-]\d{2,4}|\d{1,4}')
+
+CONFIRMED = "✅ подтверждено"
+NOT_CONFIRMED = "⚠️ не подтверждено"
+NOT_CHECKED = "⏱ не проверено"
+
+MODES = ("off", "background", "inline")
+
+
+class FactChecker:
+    """Проверка чисел и дат из ответа через RAG: параллельно, с лимитом, бюджетом времени и кэшем"""
+
+    def __init__(
+        self,
+        rag_system,
+        mode: str = FACT_CHECK_MODE,
+        concurrency: int = FACT_CHECK_CONCURRENCY,
+        budget: float = FACT_CHECK_BUDGET,
+        max_facts: int = FACT_CHECK_MAX_FACTS,
+        cache_ttl: float = FACT_CHECK_CACHE_TTL,
+        cache_size: int = FACT_CHECK_CACHE_SIZE,
+    ):
+        self.rag_system = rag_system
+        self.mode = mode if mode in MODES else "background"
+        self.budget = budget
+        self.max_facts = max_facts
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._cache: Dict[str, tuple] = {}  # {fact: (timestamp, verdict)}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._background: set = set()
+
+    def extract_facts(self, answer: str) -> List[str]:
+        """Уникальные факты в порядке появления, не больше max_facts"""
+        facts = list(dict.fromkeys(FACT_RE.findall(answer or "")))
+        return facts[:self.max_facts]
+
+    async def run(self, answer: str, mode: Optional[str] = None) -> Optional[Dict[str, str]]:
+        """off - ничего, background - проверка после ответа, inline - ждём и возвращаем вердикты"""
+        mode = mode if mode in MODES else self.mode
+        if mode == "off":
+            return None
+        if mode == "background":
+            task = asyncio.create_task(self._check_and_log(answer))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+            return None
+        return await self.check(answer)
+
+    async def check(self, answer: str) -> Dict[str, str]:
+        facts = self.extract_facts(answer)
+        if not facts:
+            return {}
+
+        tasks = {fact: self._get_task(fact) for fact in facts}
+        with stage("fact_check"):
+            done, pending = await asyncio.wait(set(tasks.values()), timeout=self.budget)
+        if pending:
+            logger.info(f"Фактчекинг: бюджет {self.budget}с исчерпан, не проверено {len(pending)}")
+
+        verdicts = {}
+        for fact, task in tasks.items():
+            if task in done and not task.cancelled() and task.exception() is None:
+                verdicts[fact] = task.result()
+            else:
+                verdicts[fact] = NOT_CHECKED
+        return verdicts
+
+    def _get_task(self, fact: str) -> asyncio.Task:
+        """Один поиск на факт: повторные и одновременные запросы берут результат из кэша или общей задачи"""
+        cached = self._cache.get(fact)
+        if cached and time.monotonic() - cached[0] < self.cache_ttl:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(cached[1])
+            return future
+
+        task = self._inflight.get(fact)
+        if task is None:
+            task = asyncio.create_task(self._lookup(fact))
+            self._inflight[fact] = task
+            task.add_done_callback(lambda _t, f=fact: self._inflight.pop(f, None))
+        return task
+
+    async def _lookup(self, fact: str) -> str:
+        async with self._semaphore:
+            context = await self.rag_system.get_relevant_context(f"{fact} Беларусь")
+        verdict = CONFIRMED if "не найдено" not in context.lower() else NOT_CONFIRMED
+
+        if len(self._cache) >= self.cache_size:
+            self._cache.pop(next(iter(self._cache)))
+        self._cache[fact] = (time.monotonic(), verdict)
+        return verdict
+
+    async def _check_and_log(self, answer: str):
+        try:
+            verdicts = await self.check(answer)
+            if verdicts:
+                confirmed = sum(1 for v in verdicts.values() if v == CONFIRMED)
+                logger.info(f"Фактчекинг: подтверждено {confirmed}/{len(verdicts)}")
+        except Exception as e:
+            logger.error(f"Ошибка фактчекинга: {e}")
+
+    async def close(self):
+        for task in list(self._background) + list(self._inflight.values()):
+            task.cancel()
+        await asyncio.gather(*self._background, *self._inflight.values(), return_exceptions=True)
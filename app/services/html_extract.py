@@ -0,0 +1,52 @@
+import asyncio
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import lxml.html
+import trafilatura
+from lxml import etree
+
+from config import PARSE_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Отдельный пул для разбора HTML, чтобы не занимать event loop
+_executor = ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix="html-extract")
+
+BOILERPLATE_TAGS = ("script", "style", "noscript", "nav", "header", "footer", "aside", "form", "iframe", "svg")
+_SPACES_RE = re.compile(r'\s+')
+
+
+def _extract_lxml(html: str) -> str:
+    """Запасной вариант: текст страницы без служебных и навигационных блоков"""
+    try:
+        tree = lxml.html.fromstring(html)
+    except (etree.ParserError, ValueError):
+        return ""
+    etree.strip_elements(tree, *BOILERPLATE_TAGS, with_tail=False)
+    etree.strip_elements(tree, etree.Comment, with_tail=False)
+    return _SPACES_RE.sub(' ', tree.text_content()).strip()
+
+
+def extract_text(html: str, max_chars: int = 2000) -> str:
+    """Основной текст страницы (trafilatura), при неудаче - lxml"""
+    if not html:
+        return ""
+    text = ""
+    try:
+        text = trafilatura.extract(html, include_comments=False, include_tables=False) or ""
+    except Exception as e:
+        logger.debug(f"trafilatura не справилась: {e}")
+    if not text:
+        text = _extract_lxml(html)
+    return _SPACES_RE.sub(' ', text).strip()[:max_chars]
+
+
+async def extract_text_async(html: str, max_chars: int = 2000) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, extract_text, html, max_chars)
+
+
+def shutdown_executor():
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,95 @@
+import logging
+
+import aiohttp
+from aiohttp import web
+
+from utils.metrics import OUTBOUND_ERRORS, OUTBOUND_REQUESTS
+from config import (
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_DNS_CACHE_TTL,
+    HTTP_KEEPALIVE_TIMEOUT,
+    HTTP_LIMIT,
+    HTTP_LIMIT_PER_HOST,
+    HTTP_READ_TIMEOUT,
+    HTTP_TOTAL_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _trace_config() -> aiohttp.TraceConfig:
+    """Счётчики исходящих запросов по хостам: статусы и ошибки"""
+
+    async def on_request_end(_session, _ctx, params):
+        OUTBOUND_REQUESTS.inc(host=params.url.host, status=params.response.status)
+
+    async def on_request_exception(_session, _ctx, params):
+        OUTBOUND_ERRORS.inc(host=params.url.host, error=type(params.exception).__name__)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_exception)
+    return trace_config
+
+
+class HttpClient:
+    """Один пул исходящих HTTP-соединений на всё приложение"""
+
+    def __init__(
+        self,
+        limit: int = HTTP_LIMIT,
+        limit_per_host: int = HTTP_LIMIT_PER_HOST,
+        dns_cache_ttl: int = HTTP_DNS_CACHE_TTL,
+        keepalive_timeout: float = HTTP_KEEPALIVE_TIMEOUT,
+        connect_timeout: float = HTTP_CONNECT_TIMEOUT,
+        read_timeout: float = HTTP_READ_TIMEOUT,
+        total_timeout: float = HTTP_TOTAL_TIMEOUT,
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(total=total_timeout, sock_connect=connect_timeout, sock_read=read_timeout)
+        self._session: aiohttp.ClientSession | None = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Общая сессия; создаётся при старте приложения или при первом обращении"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                use_dns_cache=True,
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout,
+                                                  trace_configs=[_trace_config()])
+        return self._session
+
+    async def start(self):
+        _ = self.session
+        logger.info(f"✅ HTTP клиент запущен (limit={self.limit}, per_host={self.limit_per_host})")
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        logger.info("🛑 HTTP клиент закрыт")
+
+
+# Глобальный экземпляр, общий для всех исходящих запросов
+http_client = HttpClient()
+
+
+def setup_http_client(app: web.Application):
+    """Привязываем жизненный цикл HTTP клиента к aiohttp-приложению"""
+
+    async def on_startup(_app):
+        await http_client.start()
+
+    async def on_cleanup(_app):
+        await http_client.close()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Iterable, Optional
+
+from config import (
+    MEMORY_DB,
+    MEMORY_FLUSH_INTERVAL,
+    MEMORY_HISTORY,
+    MEMORY_IDLE_TTL,
+    MEMORY_MAX_USERS,
+    MEMORY_QUERY_CHARS,
+    MEMORY_TOKEN_BUDGET,
+)
+from services.context_builder import estimate_tokens
+from services.shared_state import shared_state
+
+logger = logging.getLogger(__name__)
+
+
+class UserMemory:
+    """Короткая память одного пользователя: последние запросы и сущности"""
+
+    __slots__ = ("queries", "entities", "last_seen")
+
+    def __init__(self, queries: Iterable[str] = (), entities: Optional[Dict[str, str]] = None,
+                 last_seen: float = 0.0, history: int = MEMORY_HISTORY):
+        self.queries = deque(queries, maxlen=history)
+        self.entities = entities or {}
+        self.last_seen = last_seen
+
+    def to_json(self) -> str:
+        return json.dumps({"queries": list(self.queries), "entities": self.entities}, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, data: str, last_seen: float, history: int = MEMORY_HISTORY) -> "UserMemory":
+        raw = json.loads(data)
+        return cls(raw.get("queries", ()), raw.get("entities"), last_seen, history)
+
+
+class SQLiteMemoryBackend:
+    """Хранение памяти пользователей на диске"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS memory (user_id TEXT PRIMARY KEY, data TEXT, updated REAL)")
+        self._conn.commit()
+
+    def _load(self, user_id: str):
+        return self._conn.execute("SELECT data, updated FROM memory WHERE user_id = ?", (user_id,)).fetchone()
+
+    def _save_many(self, items: list):
+        self._conn.executemany("INSERT OR REPLACE INTO memory (user_id, data, updated) VALUES (?, ?, ?)", items)
+        self._conn.commit()
+
+    async def load(self, user_id: str):
+        return await asyncio.to_thread(self._load, user_id)
+
+    async def save_many(self, items: list):
+        await asyncio.to_thread(self._save_many, items)
+
+    def close(self):
+        self._conn.close()
+
+
+class SharedMemoryBackend:
+    """Память пользователей в общем состоянии процессов (SharedState), записи живут idle_ttl"""
+
+    def __init__(self, state, idle_ttl: float = MEMORY_IDLE_TTL):
+        self.state = state
+        self.idle_ttl = idle_ttl
+
+    async def load(self, user_id: str):
+        stored = await self.state.get("memory", user_id)
+        return None if stored is None else tuple(stored[1])
+
+    async def save_many(self, items: list):
+        for user_id, data, updated in items:
+            await self.state.set("memory", user_id, self.idle_ttl, [data, updated])
+
+    def close(self):
+        # общее состояние закрывает приложение
+        pass
+
+
+class MemoryStore:
+    """
+    Память пользователей с ограничением: не больше max_users записей в памяти,
+    вытеснение давно не писавших (LRU + idle TTL), запись на диск пачками в фоне.
+    shared - backend общий для нескольких процессов: читаем всегда из него и пишем сразу.
+    """
+
+    def __init__(self, max_users: int = MEMORY_MAX_USERS, idle_ttl: float = MEMORY_IDLE_TTL,
+                 history: int = MEMORY_HISTORY, backend: Optional[SQLiteMemoryBackend] = None,
+                 flush_interval: float = MEMORY_FLUSH_INTERVAL, shared: bool = False):
+        self.max_users = max_users
+        self.idle_ttl = idle_ttl
+        self.history = history
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.shared = shared and backend is not None
+        self._data: "OrderedDict[str, UserMemory]" = OrderedDict()
+        self._dirty: Dict[str, UserMemory] = {}
+        self._flush_task: asyncio.Task | None = None
+        self._flush_lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, user_id: str):
+        return user_id in self._data
+
+    async def get(self, user_id: str) -> Optional[UserMemory]:
+        record = self._data.get(user_id)
+        if record is not None and not self.shared:
+            self._data.move_to_end(user_id)
+            return record
+        if self.backend is None:
+            return None
+        row = await self.backend.load(user_id)
+        if row is None or time.time() - row[1] > self.idle_ttl:
+            return None
+        record = UserMemory.from_json(row[0], row[1], self.history)
+        self._put(user_id, record)
+        return record
+
+    async def remember(self, user_id: str, query: str, entities: Optional[Dict[str, str]] = None):
+        record = await self.get(user_id)
+        if record is None:
+            record = UserMemory(last_seen=time.time(), history=self.history)
+            self._put(user_id, record)
+        record.queries.append(query[:MEMORY_QUERY_CHARS])
+        if entities:
+            record.entities.update(entities)
+        record.last_seen = time.time()
+
+        if self.backend is not None:
+            self._dirty[user_id] = record
+            if self.shared:
+                await self.flush()
+            else:
+                self._ensure_flusher()
+
+    def _put(self, user_id: str, record: UserMemory):
+        self._data[user_id] = record
+        self._data.move_to_end(user_id)
+        self._evict()
+
+    def _evict(self):
+        # сначала по количеству (LRU), затем давно неактивных с начала очереди
+        while len(self._data) > self.max_users:
+            self._data.popitem(last=False)
+        deadline = time.time() - self.idle_ttl
+        while self._data:
+            user_id, record = next(iter(self._data.items()))
+            if record.last_seen >= deadline:
+                break
+            self._data.popitem(last=False)
+
+    def _ensure_flusher(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while self._dirty:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self._dirty or self.backend is None:
+            return
+        async with self._flush_lock:
+            batch, self._dirty = self._dirty, {}
+            items = [(uid, r.to_json(), r.last_seen) for uid, r in batch.items()]
+            try:
+                await self.backend.save_many(items)
+            except Exception as e:
+                logger.error(f"Ошибка сохранения памяти пользователей: {e}")
+                # вернём несохранённое обратно, новые записи важнее
+                self._dirty = {**batch, **self._dirty}
+
+    async def close(self):
+        if self._flush_task is not None:
+            # ждём, пока фоновая запись отпустит соединение
+            async with self._flush_lock:
+                self._flush_task.cancel()
+        await self.flush()
+        if self.backend is not None:
+            self.backend.close()
+            self.backend = None
+
+
+def format_history(record: Optional[UserMemory], token_budget: int = MEMORY_TOKEN_BUDGET) -> str:
+    """Последние запросы для системного промпта: самые свежие, пока влезают в бюджет токенов"""
+    if record is None or not record.queries:
+        return ""
+    lines, used = [], 0
+    for query in reversed(record.queries):
+        cost = estimate_tokens(query)
+        if used + cost > token_budget:
+            break
+        lines.append(query)
+        used += cost
+    return "\n".join(f"- {q}" for q in reversed(lines))
+
+
+def create_memory_store() -> MemoryStore:
+    if shared_state is not None:
+        return MemoryStore(backend=SharedMemoryBackend(shared_state), shared=True)
+    backend = SQLiteMemoryBackend(MEMORY_DB) if MEMORY_DB else None
+    return MemoryStore(backend=backend)
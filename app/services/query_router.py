@@ -0,0 +1,131 @@
+import logging
+import re
+import time
+from typing import Dict, Iterable, Optional
+
+from config import ROUTER_FOLLOW_UP_WINDOW, ROUTER_MAX_WORDS, ROUTER_SKIP
+from services.memory_store import UserMemory
+from utils.metrics import ROUTER_DECISIONS
+
+logger = logging.getLogger(__name__)
+
+SMALL_TALK = "small_talk"
+TIME = "time"
+FOLLOW_UP = "follow_up"
+RETRIEVE = "retrieve"
+ROUTES = (SMALL_TALK, TIME, FOLLOW_UP, RETRIEVE)
+
+_PUNCT_RE = re.compile(r'[^\w\s]')
+# фразы, после удаления которых (и слов-связок) от сообщения ничего не остаётся
+_SMALL_TALK_RE = re.compile(
+    r'\b(привет\w*|здравствуй\w*|добр\w+ (утро|день|вечер|ночи)|хай|hi|hello|'
+    r'спасибо|благодарю|спс|пока|до свидания|до встречи|'
+    r'ок|окей|ok|хорошо|понятно|ясно|отлично|супер|круто|класс|да|нет|ага|угу|'
+    r'как дела|как ты|как жизнь|кто ты|ты кто|что ты умеешь|что умеешь)\b'
+)
+# текст уже нормализован: нижний регистр, ё -> е, без пунктуации
+_FILLER = {"бот", "тебе", "вам", "большое", "очень", "ну", "а", "и", "так", "все"}
+# вопрос о времени - это сама фраза и только вежливые слова, уточнения и "в Беларуси" вокруг неё:
+# "сколько время?", "подскажите, который сейчас час", "время"; но не "какое время года" и не "время в Москве"
+_TIME_RE = re.compile(r'^(который час|сколько (времени|время)|какое время|время)$')
+_TIME_FILLER = {"а", "ну", "бот", "привет", "здравствуй", "здравствуйте", "скажи", "скажите", "подскажи",
+                "подскажите", "подскажешь", "знаешь", "не", "пожалуйста", "сейчас", "текущее", "точное",
+                "у", "вас", "нас", "в", "по", "беларуси", "минске", "минскому"}
+# признаки того, что нужны свежие данные из интернета, даже в коротком уточнении
+_FRESH_RE = re.compile(
+    r'(сегодня|вчера|завтра|новост|курс|погод|цен[аыу]|стоимост|последн|актуальн|текущ|\b20\d\d\b)'
+)
+# уточнение ссылается на прошлый вопрос ("а подробнее?", "почему он такой?") ...
+_ANAPHORA = {"подробнее", "поясни", "уточни", "продолжи", "дальше", "это", "этого", "этом", "этой", "этот", "эти",
+             "этих", "он", "она", "они", "оно", "его", "ее", "их", "нем", "ней", "них", "нему", "ним", "там", "тогда",
+             "такой", "такая", "такое", "такие"}
+# ... и кроме служебных слов не содержит ничего, чего не было в прошлом вопросе
+_FUNCTION_WORDS = {"а", "и", "но", "еще", "ли", "же", "то", "что", "как", "где", "когда", "куда", "откуда",
+                   "почему", "зачем", "кто", "какой", "какая", "какое", "какие", "сколько", "чем", "чего", "ему",
+                   "о", "об", "про", "в", "во", "на", "с", "со", "по", "для", "от", "до", "из", "у", "к", "за",
+                   "мне", "нам", "расскажи", "объясни", "можно", "больше", "значит", "означает", "случилось",
+                   "было", "был", "была", "были", "есть", "так", "именно", "пожалуйста"}
+
+
+def normalize(text: str) -> str:
+    return " ".join(_PUNCT_RE.sub(" ", text.lower().replace("ё", "е")).split())
+
+
+def is_time_query(query: str) -> bool:
+    """Вопрос о текущем времени (query уже нормализован)"""
+    return bool(_TIME_RE.match(" ".join(w for w in query.split() if w not in _TIME_FILLER)))
+
+
+def _stem(word: str) -> str:
+    # грубая основа: падежные окончания не должны делать слово "новым"
+    return word[:5]
+
+
+def is_follow_up(query: str, previous: str) -> bool:
+    """
+    Уточнение к прошлому вопросу (оба уже нормализованы): есть ссылка на него и нет новых значимых слов.
+    "А какая столица Франции?" после вопроса о Минске - новый вопрос, а не уточнение.
+    """
+    words = query.split()
+    if not any(w in _ANAPHORA for w in words):
+        return False
+    known = {_stem(w) for w in previous.split()}
+    return all(w in _ANAPHORA or w in _FUNCTION_WORDS or _stem(w) in known for w in words)
+
+
+class QueryRouter:
+    """
+    Нужен ли веб-поиск для сообщения:
+    small_talk - приветствия и реплики без вопроса,
+    time - время в Беларуси (подставляется в промпт),
+    follow_up - короткое уточнение к недавнему вопросу (контекст берётся из кэша),
+    retrieve - нужны свежие данные, идём в поиск.
+    Маршруты из skip обходятся без поиска, остальные ведут в retrieve.
+    """
+
+    def __init__(self, skip: Iterable[str] = ROUTER_SKIP, max_words: int = ROUTER_MAX_WORDS,
+                 follow_up_window: float = ROUTER_FOLLOW_UP_WINDOW):
+        self.skip = {r for r in skip if r in ROUTES and r != RETRIEVE}
+        self.max_words = max_words
+        self.follow_up_window = follow_up_window
+
+    def classify(self, text: str, record: Optional[UserMemory] = None) -> str:
+        query = normalize(text)
+        words = query.split()
+        if not words or len(words) > self.max_words:
+            return RETRIEVE
+        if is_time_query(query):
+            return TIME
+        rest = _SMALL_TALK_RE.sub(" ", query).split()
+        if all(w in _FILLER for w in rest):
+            return SMALL_TALK
+        if _FRESH_RE.search(query):
+            return RETRIEVE
+        if (record is not None and record.queries
+                and time.time() - record.last_seen <= self.follow_up_window
+                and is_follow_up(query, normalize(record.queries[-1]))):
+            return FOLLOW_UP
+        return RETRIEVE
+
+    def route(self, text: str, record: Optional[UserMemory] = None) -> str:
+        """Маршрут с учётом настройки skip; решение попадает в метрики"""
+        route = self.classify(text, record)
+        decided = route if route in self.skip else RETRIEVE
+        ROUTER_DECISIONS.inc(route=route, retrieval="yes" if decided == RETRIEVE else "no")
+        logger.debug(f"Маршрут запроса: {route}, поиск: {decided == RETRIEVE}")
+        return decided
+
+    def stats(self) -> Dict[str, float]:
+        counts = {route: 0.0 for route in ROUTES}
+        skipped = 0.0
+        for route in ROUTES:
+            for retrieval in ("yes", "no"):
+                value = ROUTER_DECISIONS.value(route=route, retrieval=retrieval)
+                counts[route] += value
+                if retrieval == "no":
+                    skipped += value
+        total = sum(counts.values())
+        return {**counts, "skipped_share": round(skipped / total, 3) if total else 0.0}
+
+
+query_router = QueryRouter()
@@ -1,86 +1,125 @@
 import asyncio
-from typing import List, Dict
+from typing import List, Dict, Optional
 from services.web_search import WebSearch
+from services.cache import ResultCache, SharedCacheBackend, SQLiteCacheBackend
+from services.context_builder import ContextBuilder
+from services.shared_state import shared_state
+from services.text_clean import clean_many, clean_many_async, clean_text
+from utils.metrics import stage
+from config import (
+    RAG_CACHE_DB,
+    RAG_CACHE_MAX_BYTES,
+    RAG_CACHE_TTL_CONTEXT,
+    RAG_CACHE_TTL_PAGE,
+    RAG_CACHE_TTL_SEARCH,
+)
 import logging
-import re
 import hashlib
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+STOP_WORDS = {'как', 'что', 'где', 'когда', 'почему', 'зачем', 'мне', 'ты', 'вы', 'свой'}
+
+
+def query_words(query: str) -> List[str]:
+    """Значимые слова запроса: нижний регистр, без стоп-слов и коротких слов"""
+    return [w for w in query.lower().split() if w not in STOP_WORDS and len(w) > 2]
+
+
+def create_rag_cache() -> ResultCache:
+    if shared_state is not None:
+        backend = SharedCacheBackend(shared_state)
+    else:
+        backend = SQLiteCacheBackend(RAG_CACHE_DB) if RAG_CACHE_DB else None
+    return ResultCache(
+        max_bytes=RAG_CACHE_MAX_BYTES,
+        ttls={"search": RAG_CACHE_TTL_SEARCH, "page": RAG_CACHE_TTL_PAGE, "context": RAG_CACHE_TTL_CONTEXT},
+        backend=backend,
+    )
+
+
+# Общий кэш для всех экземпляров RAGSystem
+rag_cache = create_rag_cache()
+
 class RAGSystem:
-    def __init__(self, always_enabled: bool = True):
-        self.web_search = WebSearch()
-        self.context_window = 4000
+    def __init__(self, always_enabled: bool = True, cache: ResultCache = None):
+        """always_enabled - искать для каждого сообщения, не глядя на маршрутизатор запросов"""
+        self.cache = cache or rag_cache  # кэш
+        self.web_search = WebSearch(cache=self.cache)
+        self.context_builder = ContextBuilder()
         self.always_enabled = always_enabled
-        self.cache = {}  # кэш
 
     def _cache_key(self, query: str):
         return hashlib.md5(query.encode('utf-8')).hexdigest()
 
     async def get_relevant_context(self, query: str) -> str:
-        """Всегда актуальный контекст"""
+        """Всегда актуальный контекст (с кэшем)"""
         try:
             current_year = datetime.now().year
             search_query = self._build_search_query(query) + f" {current_year}"
-            results = await self.web_search.search_and_extract(search_query, num_results=5)
-            context = self._format_context(results, query)
-            return context
+
+            async def build():
+                results = await self.web_search.search_and_extract(search_query, num_results=5)
+                if not results:
+                    # пустой поиск не кэшируем: None в кэш не попадает
+                    return None
+                with stage("clean"):
+                    cleaned = await clean_many_async(self._contents(results), max_len=None)
+                return self._format_context(results, query, cleaned)
+
+            with stage("rag"):
+                context = await self.cache.get_or_fetch("context", self._cache_key(f"{query}|{current_year}"), build)
+            return context or self._format_context([], query)
         except Exception as e:
             logger.error(f"RAG error: {e}")
             return f"Не удалось получить актуальные данные для запроса: {query}"
 
+    async def get_cached_context(self, query: str) -> Optional[str]:
+        """Контекст, уже собранный для запроса в этом году, без нового поиска"""
+        key = self._cache_key(f"{query}|{datetime.now().year}")
+        return await self.cache.get("context", key)
+
     def _build_search_query(self, original_query: str) -> str:
-        stop_words = {'как', 'что', 'где', 'когда', 'почему', 'зачем', 'мне', 'ты', 'вы', 'свой'}
-        words = original_query.lower().split()
-        filtered = [w for w in words if w not in stop_words and len(w) > 2]
+        filtered = query_words(original_query)
         if filtered:
             return ' '.join(filtered) + ' актуальная информация'
         return original_query + ' информация'
 
-    def _format_context(self, results: List[Dict], original_query: str) -> str:
+    def _contents(self, results: List[Dict]) -> List[str]:
+        """Тексты страниц, которые пойдут в контекст (короткие отбрасывает ContextBuilder)"""
+        return [r.get('content') or "" for r in results if len(r.get('content') or "") > 50]
+
+    def _format_context(self, results: List[Dict], original_query: str,
+                        cleaned: Optional[List[str]] = None) -> str:
         if not results:
             return f"По запросу '{original_query}' не найдено информации."
-        parts = [f"🔍 Информация по '{original_query}':", "="*50]
-        valid = 0
-        for i, r in enumerate(results, 1):
-            if r['content'] and len(r['content']) > 50:
-                domain = self._extract_domain(r['url'])
-                parts.append(f"Источник {i} | {domain}:\n{self._clean_content(r['content'])}")
-                parts.append("-"*40)
-                valid += 1
-        if valid == 0:
+        # все страницы чистятся одним пакетом, ContextBuilder берёт готовый текст
+        contents = self._contents(results)
+        if cleaned is None:
+            with stage("clean"):
+                cleaned = clean_many(contents, max_len=None)
+        clean = dict(zip(contents, cleaned)).__getitem__
+
+        # самые релевантные куски страниц в пределах бюджета токенов
+        with stage("context_build"):
+            selected = self.context_builder.select(results, original_query, clean=clean)
+        if not selected:
             return f"По запросу '{original_query}' найдено мало релевантной информации."
-        parts.append(f"Всего источников: {valid}")
-        full = "\n".join(parts)
-        return full[:self.context_window] + ("\n[...информация обрезана...]" if len(full) > self.context_window else "")
+        parts = [f"🔍 Информация по '{original_query}':", "="*50]
+        for i, chunks in selected.items():
+            domain = self._extract_domain(results[i - 1]['url'])
+            parts.append(f"Источник {i} | {domain}:\n{' … '.join(chunks)}")
+            parts.append("-"*40)
+        parts.append(f"Всего источников: {len(selected)}")
+        return "\n".join(parts)
 
     def _extract_domain(self, url: str) -> str:
         from urllib.parse import urlparse
         return urlparse(url).netloc.replace('www.', '')
 
-    def _clean_content(self, content: str) -> str:
-        # убираем лишние пробелы и переносы
-        content = re.sub(r'\s+', ' ', content)
-        # убираем markdown-заголовки ###, ##, #
-        content = re.sub(r'#{1,6}\s*', '', content)
-        # убираем жирный/курсивный (**текст**, *текст*, _текст_, __текст__)
-        content = re.sub(r'(\*\*|__)(.*?)\1', r'\2', content)  # жирный
-        content = re.sub(r'(\*|_)(.*?)\1', r'\2', content)     # курсив
-        # убираем ссылки [текст](url)
-        content = re.sub(r'\[([^\]]+)\]\(([^)]+)\)', r'\1', content)
-        # убираем явные http/https ссылки
-        content = re.sub(r'https?://\S+', '', content)
-        # убираем начальные маркеры списков (-, *, •, >)
-        content = re.sub(r'^[\s>*•-]+', '', content, flags=re.MULTILINE)
-        # убираем повторяющиеся дефисы/равенства (---, ===)
-        content = re.sub(r'[-=]{3,}', ' ', content)
-        # убираем лишние markdown-символы (остатки `~`, `>`, '`')
-        content = re.sub(r'[~`>]', '', content)
-        # финальная нормализация пробелов
-        content = re.sub(r'\s{2,}', ' ', content)
-        cleaned = content.strip()
-        return cleaned[:800] + '...' if len(cleaned) > 800 else cleaned
+    def _clean_content(self, content: str, max_len: int | None = 800) -> str:
+        return clean_text(content, max_len)
 
     async def close(self):
         await self.web_search.close()
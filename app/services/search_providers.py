@@ -0,0 +1,215 @@
+import asyncio
+import heapq
+import json
+import logging
+import math
+import os
+import re
+import time
+from abc import ABC, abstractmethod
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from bs4 import BeautifulSoup
+
+from config import (
+    GOOGLE_SEARCH_URL,
+    LOCAL_CORPUS_DIR,
+    LOCAL_MIN_SCORE,
+    SEARCH_BUDGET_GOOGLE,
+    SEARCH_BUDGET_LOCAL,
+    SEARCH_PROVIDERS,
+)
+from services.http_client import HttpClient, http_client
+from utils.metrics import stage
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall(text.lower()) if len(t) > 1]
+
+
+class SearchProvider(ABC):
+    """
+    Источник поисковой выдачи. search() возвращает список словарей
+    {url: ..., content: ...}; если content нет, страницу скачает WebSearch.
+    """
+
+    name = "base"
+
+    def __init__(self, budget: float):
+        self.budget = budget  # бюджет времени на один запрос, секунды
+
+    @abstractmethod
+    async def search(self, query: str, num_results: int) -> List[Dict]:
+        ...
+
+
+class GoogleHTMLProvider(SearchProvider):
+    """
+    Ищет ссылки в Google (через HTML-страницу).
+    ⚠️ Лучше использовать API (SerpAPI, Serper и т.п.), но пока сделаем базово.
+    """
+
+    name = "google"
+    HEADERS = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+                      "AppleWebKit/537.36 (KHTML, like Gecko) "
+                      "Chrome/120.0.0.0 Safari/537.36"
+    }
+
+    def __init__(self, budget: float = SEARCH_BUDGET_GOOGLE, http: HttpClient = None,
+                 url: str = GOOGLE_SEARCH_URL):
+        super().__init__(budget)
+        self.http = http or http_client
+        self.url = url
+
+    async def search(self, query: str, num_results: int) -> List[Dict]:
+        params = {"q": query, "num": num_results}
+        async with self.http.session.get(self.url, params=params, headers=self.HEADERS) as resp:
+            text = await resp.text()
+        return [{"url": u} for u in self.parse_links(text, num_results)]
+
+    @staticmethod
+    def parse_links(html: str, num_results: int) -> List[str]:
+        soup = BeautifulSoup(html, "lxml")
+        links = []
+        for g in soup.select("a[href]"):
+            href = g["href"]
+            # ссылки вида /url?q=https://...
+            if href.startswith("/url?"):
+                href = parse_qs(urlparse(href).query).get("q", [""])[0]
+            if href.startswith("http") and "google" not in urlparse(href).netloc and href not in links:
+                links.append(href)
+                if len(links) >= num_results:
+                    break
+        return links
+
+
+class LocalBM25Provider(SearchProvider):
+    """
+    Локальный поиск BM25 по корпусу документов с диска:
+    *.txt / *.md (заголовок - имя файла) и *.jsonl ({"url", "title", "text"} в строке).
+    """
+
+    name = "local"
+
+    def __init__(self, corpus_dir: str = LOCAL_CORPUS_DIR, budget: float = SEARCH_BUDGET_LOCAL,
+                 min_score: float = LOCAL_MIN_SCORE, k1: float = 1.5, b: float = 0.75):
+        super().__init__(budget)
+        self.min_score = min_score
+        self.k1 = k1
+        self.b = b
+        self.docs: List[Dict] = []
+        self.doc_len: List[int] = []
+        self.index: Dict[str, List[tuple]] = defaultdict(list)  # {term: [(doc_id, tf), ...]}
+        self.avg_len = 0.0
+        self._total_len = 0
+        if corpus_dir:
+            self.load_dir(corpus_dir)
+
+    def load_dir(self, corpus_dir: str):
+        if not os.path.isdir(corpus_dir):
+            logger.warning(f"Корпус для локального поиска не найден: {corpus_dir}")
+            return
+        for root, _dirs, files in os.walk(corpus_dir):
+            for fname in sorted(files):
+                path = os.path.join(root, fname)
+                if fname.endswith((".txt", ".md")):
+                    with open(path, encoding="utf-8") as f:
+                        self.add_document(f"local://{os.path.relpath(path, corpus_dir)}",
+                                          os.path.splitext(fname)[0], f.read())
+                elif fname.endswith(".jsonl"):
+                    with open(path, encoding="utf-8") as f:
+                        for line in f:
+                            if line.strip():
+                                doc = json.loads(line)
+                                self.add_document(doc.get("url") or f"local://{fname}#{len(self.docs)}",
+                                                  doc.get("title", ""), doc.get("text", ""))
+        logger.info(f"Локальный корпус: {len(self.docs)} документов, {len(self.index)} терминов")
+
+    def add_document(self, url: str, title: str, text: str):
+        doc_id = len(self.docs)
+        tokens = tokenize(f"{title} {text}")
+        self.docs.append({"url": url, "title": title, "text": text})
+        self.doc_len.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            self.index[term].append((doc_id, tf))
+        self._total_len += len(tokens)
+        self.avg_len = self._total_len / len(self.doc_len)
+
+    def rank(self, query: str, num_results: int) -> List[tuple]:
+        n = len(self.docs)
+        if not n:
+            return []
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.index.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[doc_id] / self.avg_len)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        ranked = heapq.nlargest(num_results, scores.items(), key=lambda x: x[1])
+        return [(d, s) for d, s in ranked if s >= self.min_score]
+
+    async def search(self, query: str, num_results: int) -> List[Dict]:
+        return [
+            {"url": self.docs[d]["url"], "content": self.docs[d]["text"][:2000]}
+            for d, _score in self.rank(query, num_results)
+        ]
+
+
+class FallbackSearch:
+    """Провайдеры по порядку: каждый в пределах своего бюджета, следующий добирает недостающие результаты"""
+
+    def __init__(self, providers: List[SearchProvider]):
+        self.providers = providers
+
+    async def search(self, query: str, num_results: int) -> List[Dict]:
+        results: List[Dict] = []
+        seen = set()
+        for provider in self.providers:
+            started = time.perf_counter()
+            try:
+                with stage(f"search.{provider.name}"):
+                    found = await asyncio.wait_for(provider.search(query, num_results), timeout=provider.budget)
+            except asyncio.TimeoutError:
+                logger.warning(f"Поиск {provider.name}: превышен бюджет {provider.budget}с")
+                continue
+            except Exception as e:
+                logger.error(f"Поиск {provider.name}: ошибка {e}")
+                continue
+            logger.info(f"Поиск {provider.name}: {len(found)} результатов за {time.perf_counter() - started:.3f}с")
+            for r in found:
+                if r["url"] not in seen:
+                    seen.add(r["url"])
+                    results.append(r)
+            if len(results) >= num_results:
+                break
+        return results[:num_results]
+
+
+PROVIDERS = {
+    "google": GoogleHTMLProvider,
+    "local": LocalBM25Provider,
+}
+
+
+def build_search(names: Optional[str] = None) -> FallbackSearch:
+    """Цепочка провайдеров из строки вида "local,google" (по умолчанию SEARCH_PROVIDERS)"""
+    providers = []
+    for name in (names or SEARCH_PROVIDERS).split(","):
+        name = name.strip()
+        if not name:
+            continue
+        if name not in PROVIDERS:
+            logger.warning(f"Неизвестный поисковый провайдер: {name}")
+            continue
+        providers.append(PROVIDERS[name]())
+    return FallbackSearch(providers)
@@ -0,0 +1,249 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+from config import STATE_URL
+from services.cache import SQLiteCacheBackend
+
+logger = logging.getLogger(__name__)
+
+
+class SharedState(ABC):
+    """
+    Общее состояние нескольких процессов: значения с TTL по пространствам имён и счётчики в окне.
+    get() возвращает (оставшийся ttl, значение) или None, как backend ResultCache.
+    """
+
+    @abstractmethod
+    async def get(self, namespace: str, key: str) -> Optional[Tuple[float, Any]]:
+        ...
+
+    @abstractmethod
+    async def set(self, namespace: str, key: str, ttl: float, value: Any):
+        ...
+
+    @abstractmethod
+    async def delete(self, namespace: str, key: str):
+        ...
+
+    @abstractmethod
+    async def incr(self, namespace: str, key: str, ttl: float) -> Tuple[int, float]:
+        """+1 к счётчику; окно ttl начинается с первого увеличения. Возвращает (счётчик, сколько осталось окну)"""
+
+    def close(self):
+        pass
+
+
+class SQLiteSharedState(SQLiteCacheBackend, SharedState):
+    """
+    Состояние в SQLite-файле (WAL), который открывают все процессы.
+    Файл в /dev/shm держит состояние в разделяемой памяти.
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self._conn.execute("PRAGMA busy_timeout = 5000")
+        # отменённый запрос отпускает asyncio.Lock, а поток с соединением ещё работает
+        self._thread_lock = threading.Lock()
+
+    def _get(self, namespace: str, key: str):
+        with self._thread_lock:
+            return super()._get(namespace, key)
+
+    def _set(self, namespace: str, key: str, ttl: float, value: Any):
+        with self._thread_lock:
+            super()._set(namespace, key, ttl, value)
+
+    def _incr(self, namespace: str, key: str, ttl: float) -> Tuple[int, float]:
+        now = time.time()
+        # BEGIN IMMEDIATE: счётчик читают и пишут другие процессы
+        with self._thread_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT expires, value FROM cache WHERE namespace = ? AND key = ?", (namespace, key)
+                ).fetchone()
+                if row is None or row[0] < now:
+                    count, expires = 1, now + ttl
+                else:
+                    count, expires = json.loads(row[1]) + 1, row[0]
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO cache (namespace, key, expires, value) VALUES (?, ?, ?, ?)",
+                    (namespace, key, expires, json.dumps(count)),
+                )
+                self._maybe_prune()
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+        return count, expires - now
+
+    def _delete(self, namespace: str, key: str):
+        with self._thread_lock:
+            self._conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+            self._conn.commit()
+
+    async def incr(self, namespace: str, key: str, ttl: float) -> Tuple[int, float]:
+        async with self._lock:
+            return await asyncio.to_thread(self._incr, namespace, key, ttl)
+
+    async def delete(self, namespace: str, key: str):
+        async with self._lock:
+            await asyncio.to_thread(self._delete, namespace, key)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisSharedState(SharedState):
+    """
+    Состояние в Redis (или совместимом сервере) по протоколу RESP, без сторонних библиотек.
+    Одно соединение на процесс, команды идут по очереди; при обрыве переподключаемся.
+    """
+
+    def __init__(self, url: str, prefix: str = "bot"):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.strip("/") or 0)
+        self.prefix = prefix
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    def _key(self, namespace: str, key: str) -> str:
+        return f"{self.prefix}:{namespace}:{key}"
+
+    @staticmethod
+    def _encode(*args) -> bytes:
+        out = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(out)
+
+    async def _read(self):
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis закрыл соединение")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RedisError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            size = int(rest)
+            if size < 0:
+                return None
+            data = await self._reader.readexactly(size + 2)
+            return data[:-2]
+        if kind == b"*":
+            size = int(rest)
+            return None if size < 0 else [await self._read() for _ in range(size)]
+        raise RedisError(f"Неожиданный ответ: {line!r}")
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            await self._send(("AUTH", self.password))
+        if self.db:
+            await self._send(("SELECT", self.db))
+
+    async def _send(self, *commands):
+        self._writer.write(b"".join(self._encode(*c) for c in commands))
+        await self._writer.drain()
+        # ошибки читаем все, чтобы не сбить очередь ответов
+        replies, error = [], None
+        for _ in commands:
+            try:
+                replies.append(await self._read())
+            except RedisError as e:
+                replies.append(None)
+                error = error or e
+        if error is not None:
+            raise error
+        return replies
+
+    async def execute(self, *commands):
+        """Команды одним пакетом (pipeline), ответы в том же порядке"""
+        async with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._writer is None:
+                        await self._connect()
+                    return await self._send(*commands)
+                except asyncio.CancelledError:
+                    # непрочитанные ответы сбили бы очередь следующих команд
+                    self._drop()
+                    raise
+                except (ConnectionError, OSError, asyncio.IncompleteReadError):
+                    self._drop()
+                    if attempt:
+                        raise
+
+    def _drop(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def get(self, namespace: str, key: str) -> Optional[Tuple[float, Any]]:
+        k = self._key(namespace, key)
+        value, pttl = await self.execute(("GET", k), ("PTTL", k))
+        if value is None:
+            return None
+        return (pttl / 1000 if pttl > 0 else 0.0), json.loads(value)
+
+    async def set(self, namespace: str, key: str, ttl: float, value: Any):
+        await self.execute(("SET", self._key(namespace, key), json.dumps(value, ensure_ascii=False),
+                            "PX", max(1, int(ttl * 1000))))
+
+    async def delete(self, namespace: str, key: str):
+        await self.execute(("DEL", self._key(namespace, key)))
+
+    async def incr(self, namespace: str, key: str, ttl: float) -> Tuple[int, float]:
+        k = self._key(namespace, key)
+        count, pttl = await self.execute(("INCR", k), ("PTTL", k))
+        if pttl < 0:
+            # первое увеличение (или ключ без срока после сбоя) - начинаем окно
+            pttl = max(1, int(ttl * 1000))
+            await self.execute(("PEXPIRE", k, pttl))
+        return count, pttl / 1000
+
+    def close(self):
+        self._drop()
+
+
+def create_shared_state(url: str = STATE_URL) -> Optional[SharedState]:
+    """sqlite:///путь или redis://[:пароль@]host:port/db; пусто - состояние в памяти процесса"""
+    if not url:
+        return None
+    if url.startswith(("redis://", "tcp://")):
+        return RedisSharedState(url)
+    if url.startswith("sqlite://"):
+        url = url[len("sqlite://"):]
+        # sqlite:///file -> file, sqlite:////abs/file -> /abs/file
+        url = url[1:] if url.startswith("/") else url
+    return SQLiteSharedState(url)
+
+
+# Общее состояние процессов (None - всё хранится в памяти этого процесса)
+shared_state = create_shared_state()
+
+
+def close_shared_state():
+    if shared_state is not None:
+        shared_state.close()
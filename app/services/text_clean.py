@@ -0,0 +1,108 @@
+import asyncio
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+from config import CLEAN_WORKERS
+
+# Шаги и их порядок те же, что в исходной очистке (результат должен совпадать байт в байт):
+# выделение снимается до удаления ссылок, поэтому '_' внутри URL может спариться с '_' в тексте.
+# Шаг пропускается, если в тексте нет его символов.
+_HEADING_RE = re.compile(r'#{1,6}\s*')
+_BOLD_RE = re.compile(r'(\*\*|__)(.*?)\1')
+_ITALIC_RE = re.compile(r'(\*|_)(.*?)\1')
+_LINK_RE = re.compile(r'\[([^\]]+)\]\(([^)]+)\)')
+_URL_RE = re.compile(r'https?://\S+')
+_RULE_RE = re.compile(r'[-=]{3,}')
+_RULE_PAIRS = ('--', '==', '-=', '=-')
+_MULTI_SPACE_RE = re.compile(r' {2,}')
+_MARKDOWN_TRASH = '~`>'
+# после схлопывания пробелов переносов нет, маркер списка снимается только в начале текста
+_LIST_MARKERS = ' >*•-'
+# место, где текст можно обрезать без влияния на результат: не пробел и не '#' перед пробелом
+_CUT_RE = re.compile(r'[^\s#](?=\s)')
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _clean_full(content: str) -> str:
+    # то же, что re.sub(r'\s+', ' '), но без пробелов по краям - их всё равно срежет strip
+    content = ' '.join(content.split())
+    if '#' in content:
+        content = _HEADING_RE.sub('', content)
+    if '*' in content or '_' in content:
+        content = _BOLD_RE.sub(r'\2', content)
+        content = _ITALIC_RE.sub(r'\2', content)
+    if '[' in content:
+        content = _LINK_RE.sub(r'\1', content)
+    if 'http' in content:
+        content = _URL_RE.sub('', content)
+    # пробелы здесь уже только ' ', так что '^[\s>*•-]+' - это lstrip
+    content = content.lstrip(_LIST_MARKERS)
+    if any(pair in content for pair in _RULE_PAIRS):
+        content = _RULE_RE.sub(' ', content)
+    for char in _MARKDOWN_TRASH:
+        if char in content:
+            content = content.replace(char, '')
+    if '  ' in content:
+        content = _MULTI_SPACE_RE.sub(' ', content)
+    return content.strip()
+
+
+def _safe_prefix(content: str, size: int) -> Optional[str]:
+    """
+    Префикс, очистка которого совпадает с началом очистки всего текста:
+    обрезка по пробелу и без символов, чьи пары могут оказаться дальше ('*', '_', '[').
+    """
+    match = _CUT_RE.search(content, size)
+    if match is None:
+        return None
+    prefix = content[:match.end()]
+    if '*' in prefix or '_' in prefix or '[' in prefix:
+        return None
+    return prefix
+
+
+def clean_text(content: str, max_len: Optional[int] = 800) -> str:
+    """Текст страницы без markdown, ссылок и лишних пробелов, не длиннее max_len (+ '...')"""
+    if max_len is None:
+        return _clean_full(content)
+    # очистка только укорачивает текст: при длинном входе пробуем обойтись его началом
+    size = max(max_len * 2, 256)
+    while size < len(content):
+        prefix = _safe_prefix(content, size)
+        if prefix is None:
+            break
+        cleaned = _clean_full(prefix)
+        if len(cleaned) > max_len:
+            return cleaned[:max_len] + '...'
+        size *= 2
+    cleaned = _clean_full(content)
+    return cleaned[:max_len] + '...' if len(cleaned) > max_len else cleaned
+
+
+def clean_many(contents: List[str], max_len: Optional[int] = 800) -> List[str]:
+    """Очистка всех результатов поиска разом"""
+    return [clean_text(content, max_len) for content in contents]
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=CLEAN_WORKERS)
+    return _process_pool
+
+
+async def clean_many_async(contents: List[str], max_len: Optional[int] = 800) -> List[str]:
+    """Пакетная очистка; при CLEAN_WORKERS > 0 - в пуле процессов, иначе прямо в event loop"""
+    if CLEAN_WORKERS <= 0 or not contents:
+        return clean_many(contents, max_len)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_pool(), clean_many, contents, max_len)
+
+
+def shutdown_pool():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(cancel_futures=True)
+        _process_pool = None
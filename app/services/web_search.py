@@ -1,80 +1,251 @@
 import aiohttp
 import asyncio
 import logging
-from typing import List, Dict
-from bs4 import BeautifulSoup
+import math
+import time
+from collections import OrderedDict, deque
+from typing import List, Dict, Optional, Tuple
 from urllib.parse import urlparse
+import hashlib
+from services.http_client import HttpClient, http_client
+from services.search_providers import FallbackSearch, build_search
+from services.html_extract import extract_text_async
+from config import (
+    DOMAIN_SLOW_AFTER,
+    DOMAIN_STATS_TTL,
+    FETCH_DEADLINE,
+    FETCH_HEDGE,
+    FETCH_HEDGE_DELAY,
+    FETCH_MIN_CHARS,
+    FETCH_MIN_PAGES,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_READ_TIMEOUT,
+    PAGE_MAX_BYTES,
+    PAGE_TIMEOUT,
+)
+from utils.metrics import PAGE_FANOUT, stage
 
 logger = logging.getLogger(__name__)
 
-class WebSearch:
-    def __init__(self):
-        self.session: aiohttp.ClientSession | None = None
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+# страница получает свой общий лимит, но те же таймауты соединения и чтения, что и общая сессия
+PAGE_CLIENT_TIMEOUT = aiohttp.ClientTimeout(total=PAGE_TIMEOUT, sock_connect=HTTP_CONNECT_TIMEOUT,
+                                            sock_read=HTTP_READ_TIMEOUT)
 
-    async def _get_session(self) -> aiohttp.ClientSession:
-        if not self.session or self.session.closed:
-            self.session = aiohttp.ClientSession()
-        return self.session
 
-    async def search_google_async(self, query: str, num_results: int = 5) -> List[str]:
-        """
-        Ищет ссылки в Google (через HTML-страницу).
-        ⚠️ Лучше использовать API (SerpAPI, Serper и т.п.), но пока сделаем базово.
-        """
-        session = await self._get_session()
-        url = f"https://www.google.com/search?q={query}&num={num_results}"
+def domain_of(url: str) -> str:
+    return urlparse(url).netloc.replace('www.', '')
+
+
+class DomainStats:
+    """
+    Скользящие средние времени загрузки и доли ошибок по доменам.
+    Медленные и часто падающие домены качаются в последнюю очередь; через ttl без новых замеров домен
+    снова считается обычным.
+    """
+
+    def __init__(self, slow_after: float = DOMAIN_SLOW_AFTER, max_failures: float = 0.5,
+                 ttl: float = DOMAIN_STATS_TTL, alpha: float = 0.3, max_domains: int = 2000):
+        self.slow_after = slow_after
+        self.max_failures = max_failures
+        self.ttl = ttl
+        self.alpha = alpha
+        self.max_domains = max_domains
+        self._stats: "OrderedDict[str, list]" = OrderedDict()  # {домен: [задержка, доля ошибок, замеров, время]}
 
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                          "AppleWebKit/537.36 (KHTML, like Gecko) "
-                          "Chrome/120.0.0.0 Safari/537.36"
+    def observe(self, url: str, latency: float, ok: bool = True, partial: bool = False):
+        """partial - загрузку отменили, известно только, что она шла не меньше latency"""
+        domain = domain_of(url)
+        item = self._stats.get(domain)
+        if item is None:
+            item = self._stats[domain] = [latency, 0.0 if ok else 1.0, 0, 0.0]
+        elif partial:
+            item[0] = max(item[0], latency)
+        else:
+            item[0] += self.alpha * (latency - item[0])
+            item[1] += self.alpha * ((0.0 if ok else 1.0) - item[1])
+        item[2] += 0 if partial else 1
+        item[3] = time.monotonic()
+        self._stats.move_to_end(domain)
+        while len(self._stats) > self.max_domains:
+            self._stats.popitem(last=False)
+
+    def _slow(self, item: Optional[list]) -> bool:
+        if item is None or time.monotonic() - item[3] > self.ttl:
+            return False
+        return item[0] > self.slow_after or item[1] > self.max_failures
+
+    def is_slow(self, url: str) -> bool:
+        return self._slow(self._stats.get(domain_of(url)))
+
+    def order(self, results: List[Dict]) -> List[Dict]:
+        """Порядок выдачи сохраняется, медленные домены уходят в конец"""
+        return sorted(results, key=lambda r: not r.get("content") and self.is_slow(r["url"]))
+
+    def stats(self, top: int = 10) -> Dict:
+        slow = [(d, item) for d, item in self._stats.items() if self._slow(item)]
+        slow.sort(key=lambda x: -x[1][0])
+        return {
+            "domains": len(self._stats),
+            "slow": {d: {"latency": round(item[0], 3), "failures": round(item[1], 3), "samples": item[2]}
+                     for d, item in slow[:top]},
         }
 
-        async with session.get(url, headers=headers) as resp:
-            text = await resp.text()
 
-        soup = BeautifulSoup(text, "html.parser")
-        links = []
+class WebSearch:
+    def __init__(self, cache=None, http: HttpClient = None, search: FallbackSearch = None,
+                 domains: DomainStats = None, deadline: float = FETCH_DEADLINE, min_pages: int = FETCH_MIN_PAGES,
+                 min_chars: int = FETCH_MIN_CHARS, hedge: int = FETCH_HEDGE, hedge_delay: float = FETCH_HEDGE_DELAY):
+        self.http = http or http_client  # общий пул соединений приложения
+        self.cache = cache  # ResultCache или None
+        self.search = search or build_search()  # цепочка поисковых провайдеров
+        self.domains = domains or DomainStats()
+        self.deadline = deadline  # общий дедлайн загрузки страниц, 0 - ждать все
+        self.min_pages = min_pages  # сколько хороших страниц достаточно, 0 - все
+        self.min_chars = min_chars
+        self.hedge = hedge  # запасные ссылки сверх num_results
+        self.hedge_delay = hedge_delay
+
+    def _cache_key(self, value: str) -> str:
+        return hashlib.md5(value.encode('utf-8')).hexdigest()
+
+    async def _cached(self, namespace: str, key: str, fetch):
+        if self.cache is None:
+            return await fetch()
+        return await self.cache.get_or_fetch(namespace, self._cache_key(key), fetch)
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        return self.http.session
 
-        for g in soup.select("a"):
-            href = g.get("href")
-            if href and href.startswith("http") and "google" not in href:
-                links.append(href)
-        return links[:num_results]
+    async def fetch_html(self, url: str, max_bytes: int = PAGE_MAX_BYTES) -> str:
+        """Потоковое скачивание HTML: не-HTML пропускаем, читаем не больше max_bytes"""
+        session = await self._get_session()
+        async with session.get(url, timeout=PAGE_CLIENT_TIMEOUT) as resp:
+            if resp.status != 200:
+                logger.info(f"Пропуск {url}: статус {resp.status}")
+                return ""
+            if resp.content_type not in HTML_CONTENT_TYPES:
+                logger.info(f"Пропуск {url}: {resp.content_type}")
+                return ""
+            body = bytearray()
+            async for chunk in resp.content.iter_chunked(16384):
+                body += chunk
+                if len(body) >= max_bytes:
+                    del body[max_bytes:]
+                    break
+            encoding = resp.charset or "utf-8"
+        try:
+            return body.decode(encoding, errors="replace")
+        except LookupError:
+            return body.decode("utf-8", errors="replace")
 
     async def fetch_page(self, url: str) -> str:
-        """Скачивание и очистка текста страницы"""
+        """Скачивание страницы и извлечение основного текста (в пуле потоков)"""
+        started = time.monotonic()
         try:
-            session = await self._get_session()
-            async with session.get(url, timeout=10) as resp:
-                html = await resp.text()
+            with stage("fetch_page"):
+                html = await self.fetch_html(url)
+        except asyncio.CancelledError:
+            self.domains.observe(url, time.monotonic() - started, partial=True)
+            raise
         except Exception as e:
+            self.domains.observe(url, time.monotonic() - started, ok=False)
             logger.error(f"Ошибка при загрузке {url}: {e}")
             return ""
-
-        soup = BeautifulSoup(html, "html.parser")
-        for tag in soup(["script", "style", "noscript"]):
-            tag.extract()
-        text = soup.get_text(" ", strip=True)
-        return text[:2000]  # ограничим размер
+        self.domains.observe(url, time.monotonic() - started, ok=bool(html))
+        with stage("extract"):
+            return await extract_text_async(html, max_chars=2000)  # ограничим размер
 
     async def search_and_extract(self, query: str, num_results: int = 5) -> List[Dict]:
         """
         Выполняет поиск и возвращает список словарей:
         [{url: ..., content: ...}, ...]
         """
-        urls = await self.search_google_async(query, num_results)
-        tasks = [self.fetch_page(u) for u in urls]
-        contents = await asyncio.gather(*tasks, return_exceptions=True)
-
-        results = []
-        for u, c in zip(urls, contents):
-            if isinstance(c, Exception):
-                logger.error(f"Ошибка при обработке {u}: {c}")
-                continue
-            results.append({"url": u, "content": c})
-        return results
+        # запасные ссылки запрашиваем сразу, чтобы было чем заменить мёртвые
+        wanted = num_results + self.hedge
+        found = await self._cached("search", f"{query}|{wanted}",
+                                   lambda: self.search.search(query, wanted))
+
+        with stage("fetch_pages"):
+            pages = await self._fan_out(self.domains.order(found), num_results)
+        return [{"url": r["url"], "content": c} for r, c in pages]
+
+    async def _content_of(self, r: Dict) -> str:
+        # страницы качаем только для результатов без готового текста (локальный корпус отдаёт его сразу)
+        if r.get("content"):
+            return r["content"]
+        return await self._cached("page", r["url"], lambda: self.fetch_page(r["url"]))
+
+    async def _fan_out(self, candidates: List[Dict], num_results: int) -> List[Tuple[Dict, str]]:
+        """
+        Параллельная загрузка первых num_results страниц. Пустая страница или ошибка сразу заменяется
+        запасной ссылкой, через hedge_delay запасные запускаются все. Возвращаемся, как только набралось
+        min_pages хороших страниц или вышел дедлайн; недокачанные страницы отменяются.
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + self.deadline if self.deadline > 0 else None
+        need = self.min_pages if self.min_pages > 0 else math.inf
+        tasks: Dict[asyncio.Task, int] = {}  # {загрузка: номер кандидата}
+        spare = deque(range(min(num_results, len(candidates)), len(candidates)))
+        hedge_at: Optional[float] = started + self.hedge_delay if spare else None
+        contents: Dict[int, str] = {}
+        good = 0
+        outcome = "complete"
+
+        def launch(i: int):
+            tasks[asyncio.create_task(self._content_of(candidates[i]))] = i
+
+        for i in range(min(num_results, len(candidates))):
+            launch(i)
+        try:
+            while tasks:
+                wake = min((t for t in (deadline, hedge_at) if t is not None), default=None)
+                done, _ = await asyncio.wait(tasks, timeout=None if wake is None else max(wake - loop.time(), 0),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    i = tasks.pop(task)
+                    content = self._task_content(task, candidates[i])
+                    if content:
+                        contents[i] = content
+                    if len(content) >= self.min_chars:
+                        good += 1
+                    elif spare:
+                        PAGE_FANOUT.inc(event="hedged")
+                        launch(spare.popleft())
+                if good >= need:
+                    outcome = "enough"
+                    break
+                now = loop.time()
+                if deadline is not None and now >= deadline:
+                    outcome = "deadline"
+                    break
+                if hedge_at is not None and now >= hedge_at:
+                    PAGE_FANOUT.inc(len(spare), event="hedged")
+                    while spare:
+                        launch(spare.popleft())
+                    hedge_at = None
+        finally:
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                PAGE_FANOUT.inc(len(tasks), event="cancelled")
+                await asyncio.gather(*tasks, return_exceptions=True)
+        PAGE_FANOUT.inc(event=outcome)
+
+        # хорошие страницы вперёд, в пределах num_results; порядок выдачи сохраняем
+        chosen = sorted(contents, key=lambda i: (len(contents[i]) < self.min_chars, i))[:num_results]
+        return [(candidates[i], contents[i]) for i in sorted(chosen)]
+
+    def _task_content(self, task: asyncio.Task, r: Dict) -> str:
+        if task.cancelled():
+            # общую загрузку страницы отменил другой запрос
+            return ""
+        if task.exception() is not None:
+            logger.error(f"Ошибка при обработке {r['url']}: {task.exception()}")
+            return ""
+        return task.result() or ""
 
     async def close(self):
-        if self.session and not self.session.closed:
-            await self.session.close()
+        # сессия общая, её закрывает http_client при остановке приложения
+        pass
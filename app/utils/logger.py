@@ -1,8 +1,26 @@
 import logging
+import uuid
+from contextvars import ContextVar
+
+# Trace ID текущего запроса, попадает в каждую строку лога
+trace_id_var: ContextVar[str] = ContextVar("trace_id", default="-")
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+class TraceIdFilter(logging.Filter):
+    def filter(self, record):
+        record.trace_id = trace_id_var.get()
+        return True
+
 
 def setup_logger():
     logging.basicConfig(
         level=logging.INFO,
-        format="%(asctime)s - [%(levelname)s] - %(name)s - %(message)s"
+        format="%(asctime)s - [%(levelname)s] - %(name)s - [%(trace_id)s] - %(message)s"
     )
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(TraceIdFilter())
     return logging.getLogger("ai21_bot")
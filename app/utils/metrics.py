@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+from aiohttp import web
+
+from utils.logger import new_trace_id, trace_id_var
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _labels_key(labels: Dict[str, str]) -> Tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: Tuple, extra: Tuple = ()) -> str:
+    items = key + extra
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()  # разбор HTML идёт в пуле потоков
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_labels_key(labels), 0)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_labels_key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple = LATENCY_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = buckets
+        self._values: Dict[Tuple, list] = {}  # {labels: [counts по бакетам..., sum, count]}
+
+    def observe(self, value: float, **labels):
+        key = _labels_key(labels)
+        with self._lock:
+            data = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, data in sorted(self._values.items()):
+            for bound, count in zip(self.buckets, data):
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', bound),))} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, (('le', '+Inf'),))} {data[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {data[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {data[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_LATENCY = registry.register(Histogram("stage_duration_seconds", "Длительность этапов обработки запроса"))
+STAGE_IN_FLIGHT = registry.register(Gauge("stage_in_flight", "Сколько этапов выполняется прямо сейчас"))
+STAGE_ERRORS = registry.register(Counter("stage_errors_total", "Ошибки по этапам"))
+HTTP_REQUESTS = registry.register(Counter("http_requests_total", "Входящие HTTP-запросы"))
+HTTP_LATENCY = registry.register(Histogram("http_request_duration_seconds", "Длительность входящих HTTP-запросов"))
+HTTP_IN_FLIGHT = registry.register(Gauge("http_requests_in_flight", "Входящие запросы в обработке"))
+OUTBOUND_REQUESTS = registry.register(Counter("outbound_requests_total", "Исходящие HTTP-запросы по хостам и статусам"))
+OUTBOUND_ERRORS = registry.register(Counter("outbound_errors_total", "Ошибки исходящих HTTP-запросов"))
+CACHE_EVENTS = registry.register(Counter("cache_events_total", "Попадания, промахи и вытеснения кэша"))
+AI21_TOKENS = registry.register(Counter("ai21_tokens_total", "Токены AI21 (prompt/completion)"))
+ADMISSION_EVENTS = registry.register(Counter("admission_events_total", "Решения контроля допуска /api/chat"))
+ADMISSION_QUEUE = registry.register(Gauge("admission_queue_size", "Запросы /api/chat в очереди на обработку"))
+ROUTER_DECISIONS = registry.register(Counter("router_decisions_total", "Маршруты запросов и нужен ли был поиск"))
+PAGE_FANOUT = registry.register(Counter("page_fanout_total", "Загрузка страниц: исходы, запасные и отменённые загрузки"))
+WEBHOOK_UPDATES = registry.register(Counter("webhook_updates_total", "Апдейты Telegram: приняты, повторы, отказы, обработаны"))
+WEBHOOK_QUEUE = registry.register(Gauge("webhook_queue_size", "Апдейты Telegram в очереди и в обработке"))
+LOOP_LAG = registry.register(Histogram("event_loop_lag_seconds", "Задержка event loop относительно расписания",
+                                       buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)))
+
+
+@contextmanager
+def stage(name: str):
+    """Замер этапа: гистограмма длительности, in-flight и ошибки"""
+    STAGE_IN_FLIGHT.inc(stage=name)
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_LATENCY.observe(elapsed, stage=name)
+        STAGE_IN_FLIGHT.dec(stage=name)
+        logger.debug(f"Этап {name}: {elapsed * 1000:.1f} мс")
+
+
+def count_tokens(usage):
+    """Учёт токенов из usage ответа AI21"""
+    if usage is None:
+        return
+    AI21_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, kind="prompt")
+    AI21_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, kind="completion")
+
+
+async def monitor_loop_lag(interval: float = 0.25):
+    """Насколько позже запланированного просыпается задача - показатель блокировок event loop"""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(0.0, loop.time() - expected))
+
+
+def _route_name(request: web.Request) -> str:
+    route = request.match_info.route
+    resource = route.resource if route is not None else None
+    return resource.canonical if resource is not None else "unmatched"
+
+
+@web.middleware
+async def metrics_middleware(request: web.Request, handler):
+    """Trace ID на запрос (из X-Request-ID или новый) и метрики входящих запросов"""
+    trace_id = request.headers.get("X-Request-ID") or new_trace_id()
+    token = trace_id_var.set(trace_id)
+    path = _route_name(request)
+    HTTP_IN_FLIGHT.inc(path=path)
+    started = time.perf_counter()
+    status = 500
+    try:
+        resp = await handler(request)
+        status = resp.status
+        if not resp.prepared:
+            resp.headers["X-Request-ID"] = trace_id
+        return resp
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        HTTP_LATENCY.observe(time.perf_counter() - started, path=path)
+        HTTP_REQUESTS.inc(path=path, method=request.method, status=status)
+        HTTP_IN_FLIGHT.dec(path=path)
+        trace_id_var.reset(token)
+
+
+async def metrics_handler(request: web.Request):
+    return web.Response(text=registry.render(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
@@ -0,0 +1,54 @@
+import asyncio
+import logging
+import time
+
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from config import TELEGRAM_EDIT_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_LIMIT = 4096  # максимальная длина сообщения
+CURSOR = " ▌"
+
+
+class StreamingReply:
+    """Прогрессивный ответ в Telegram: одно сообщение, которое редактируется не чаще раза в interval секунд"""
+
+    def __init__(self, message: types.Message, interval: float = TELEGRAM_EDIT_INTERVAL):
+        self.message = message
+        self.interval = interval
+        self.sent: types.Message | None = None
+        self.last_text = ""
+        self.next_edit = 0.0
+
+    async def update(self, text: str):
+        if not text.strip() or time.monotonic() < self.next_edit:
+            return
+        await self._render(text[:TELEGRAM_LIMIT - len(CURSOR)] + CURSOR)
+
+    async def finish(self, text: str):
+        text = text or "❌ Бот не смог обработать запрос."
+        await self._render(text[:TELEGRAM_LIMIT], force=True)
+        for i in range(TELEGRAM_LIMIT, len(text), TELEGRAM_LIMIT):
+            await self.message.answer(text[i:i + TELEGRAM_LIMIT])
+
+    async def _render(self, text: str, force: bool = False):
+        if text == self.last_text:
+            return
+        try:
+            if self.sent is None:
+                self.sent = await self.message.answer(text)
+            else:
+                await self.sent.edit_text(text)
+            self.last_text = text
+            self.next_edit = time.monotonic() + self.interval
+        except TelegramRetryAfter as e:
+            # промежуточные правки просто пропускаем, финальную дожидаемся
+            self.next_edit = time.monotonic() + e.retry_after
+            if force:
+                await asyncio.sleep(e.retry_after)
+                await self._render(text, force=True)
+        except TelegramBadRequest as e:
+            logger.debug(f"Не удалось обновить сообщение: {e}")
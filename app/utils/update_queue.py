@@ -0,0 +1,193 @@
+import asyncio
+import contextvars
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+
+from config import WEBHOOK_DEDUP_SIZE, WEBHOOK_DRAIN_TIMEOUT, WEBHOOK_QUEUE_SIZE, WEBHOOK_WORKERS
+from services.shared_state import SharedState
+from utils.logger import new_trace_id, trace_id_var
+from utils.metrics import WEBHOOK_QUEUE, WEBHOOK_UPDATES
+
+logger = logging.getLogger(__name__)
+
+ACCEPTED = "accepted"
+DUPLICATE = "duplicate"
+REJECTED = "rejected"
+
+_CHAT_FIELDS = ("message", "edited_message", "channel_post", "edited_channel_post", "callback_query",
+                "inline_query", "my_chat_member", "chat_member", "chat_join_request")
+
+
+def chat_key(update: Dict[str, Any]) -> Any:
+    """Чат (или пользователь), в пределах которого апдейты обрабатываются по порядку"""
+    for field in _CHAT_FIELDS:
+        event = update.get(field)
+        if not isinstance(event, dict):
+            continue
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat and "id" in chat:
+            return chat["id"]
+        sender = event.get("from")
+        if sender and "id" in sender:
+            return sender["id"]
+    return ("update", update.get("update_id"))
+
+
+class UpdateQueue:
+    """
+    Очередь апдейтов Telegram с пулом обработчиков:
+    ограниченный размер, повторы по update_id отбрасываются (помним последние dedup_size),
+    апдейты одного чата идут строго по очереди, разные чаты - параллельно.
+    """
+
+    def __init__(self, handle: Callable[[Dict[str, Any]], Awaitable[Any]], workers: int = WEBHOOK_WORKERS,
+                 max_size: int = WEBHOOK_QUEUE_SIZE, dedup_size: int = WEBHOOK_DEDUP_SIZE,
+                 drain_timeout: float = WEBHOOK_DRAIN_TIMEOUT):
+        self.handle = handle
+        self.workers = workers
+        self.max_size = max_size
+        self.drain_timeout = drain_timeout
+        self._lanes: Dict[Any, Deque[Dict[str, Any]]] = {}  # {чат: апдейты в порядке прихода}
+        self._ready: Optional[asyncio.Queue] = None  # чаты, чей следующий апдейт можно брать в работу
+        self._pending = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._seen: set = set()
+        self._seen_order: deque = deque(maxlen=dedup_size)
+        self._tasks: List[asyncio.Task] = []
+        self._closed = False
+
+    def __len__(self):
+        return self._pending
+
+    def _start(self):
+        self._ready = asyncio.Queue()
+        # воркеры создаются внутри первого запроса: чистый контекст, чтобы не унаследовать его trace_id
+        self._tasks = [asyncio.create_task(self._worker(), context=contextvars.Context())
+                       for _ in range(self.workers)]
+
+    def _remember(self, update_id) -> bool:
+        """False, если апдейт уже был"""
+        if update_id is None:
+            return True
+        if update_id in self._seen:
+            return False
+        if len(self._seen_order) == self._seen_order.maxlen:
+            self._seen.discard(self._seen_order[0])
+        self._seen_order.append(update_id)
+        self._seen.add(update_id)
+        return True
+
+    def put(self, update: Dict[str, Any]) -> str:
+        if self._closed or self._pending >= self.max_size:
+            outcome = REJECTED
+        elif not self._remember(update.get("update_id")):
+            outcome = DUPLICATE
+        else:
+            if self._ready is None:
+                self._start()
+            key = chat_key(update)
+            lane = self._lanes.get(key)
+            if lane is None:
+                # новый чат ставим в очередь; у занятого чата апдейт подождёт своей очереди
+                lane = self._lanes[key] = deque()
+                self._ready.put_nowait(key)
+            lane.append(update)
+            self._pending += 1
+            self._idle.clear()
+            WEBHOOK_QUEUE.set(self._pending)
+            outcome = ACCEPTED
+        WEBHOOK_UPDATES.inc(outcome=outcome)
+        return outcome
+
+    async def _worker(self):
+        while True:
+            key = await self._ready.get()
+            lane = self._lanes[key]
+            update = lane.popleft()
+            trace_id_var.set(new_trace_id())  # свой trace_id у каждого апдейта
+            try:
+                await self.handle(update)
+                WEBHOOK_UPDATES.inc(outcome="processed")
+            except Exception:
+                WEBHOOK_UPDATES.inc(outcome="failed")
+                logger.exception(f"Ошибка обработки апдейта {update.get('update_id')}")
+            finally:
+                self._pending -= 1
+                WEBHOOK_QUEUE.set(self._pending)
+                if lane:
+                    # следующий апдейт чата - в конец общей очереди, чтобы не держать других
+                    self._ready.put_nowait(key)
+                else:
+                    del self._lanes[key]
+                if not self._pending:
+                    self._idle.set()
+
+    async def drain(self):
+        """Перестаём принимать апдейты и ждём обработки принятых (не дольше drain_timeout)"""
+        self._closed = True
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=self.drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не дождались обработки {self._pending} апдейтов при остановке")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> Dict[str, Any]:
+        return {"pending": self._pending, "chats": len(self._lanes), "workers": self.workers, "closed": self._closed}
+
+
+class QueuedRequestHandler(SimpleRequestHandler):
+    """
+    Webhook, который сразу отвечает Telegram и кладёт апдейт в UpdateQueue.
+    С общим state повторы по update_id отсекаются и между процессами (окно dedup_ttl секунд).
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, state: Optional[SharedState] = None,
+                 dedup_ttl: float = 3600, **kwargs):
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True)
+        self.updates = UpdateQueue(self._feed, **kwargs)
+        self.state = state
+        self.dedup_ttl = dedup_ttl
+
+    async def _feed(self, update: Dict[str, Any]):
+        await self._background_feed_update(bot=self.bot, update=update)
+
+    async def _first_delivery(self, update_id) -> bool:
+        if self.state is None or update_id is None:
+            return True
+        try:
+            count, _ = await self.state.incr("update", str(update_id), self.dedup_ttl)
+        except Exception as e:
+            logger.warning(f"Ошибка общей проверки повторов: {e}")
+            return True
+        return count == 1
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        update_id = update.get("update_id")
+        if not await self._first_delivery(update_id):
+            WEBHOOK_UPDATES.inc(outcome=DUPLICATE)
+            return web.json_response({}, dumps=bot.session.json_dumps)
+        if self.updates.put(update) == REJECTED:
+            if self.state is not None and update_id is not None:
+                # повтор от Telegram не должен считаться дублем
+                try:
+                    await self.state.delete("update", str(update_id))
+                except Exception as e:
+                    logger.warning(f"Ошибка общей проверки повторов: {e}")
+            # Telegram повторит доставку позже
+            return web.json_response({"ok": False}, status=503, dumps=bot.session.json_dumps)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def close(self):
+        # вызывается в on_shutdown приложения: сначала дорабатываем принятые апдейты, потом закрываем сессию
+        await self.updates.drain()
+        await super().close()
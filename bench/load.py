@@ -0,0 +1,258 @@
+"""
+Нагрузочный бенчмарк без сети: поднимает заглушки внешних сервисов,
+запускает бота отдельным процессом и гоняет /api/chat и /webhook/bot
+с заданной параллельностью.
+
+    python bench/load.py --concurrency 16 --requests 200 --target both
+    python bench/load.py --workers 4 --state redis   # несколько процессов с общим состоянием
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, List
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from stubs import StubConfig, start_redis_stub, start_stubs, telegram_update  # noqa: E402
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+QUESTIONS = [
+    "Какое население Минска?",
+    "Какой курс белорусского рубля сегодня?",
+    "Какие областные центры есть в Беларуси?",
+    "Какая погода в Минске зимой?",
+    "Когда открылась Национальная библиотека Беларуси?",
+]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb(pid: int) -> float:
+    """Пиковый RSS процесса (VmHWM) вместе с дочерними процессами, только Linux"""
+    total = 0.0
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    total += int(line.split()[1]) / 1024
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            total += sum(peak_rss_mb(int(child)) for child in f.read().split())
+    except OSError:
+        pass
+    return total
+
+
+def histogram_quantile(metrics_text: str, name: str, q: float) -> float:
+    """Квантиль по бакетам Prometheus-гистограммы (верхняя граница бакета)"""
+    buckets = []
+    for bound, count in re.findall(rf'^{name}_bucket\{{.*le="([^"]+)"\}} (\S+)$', metrics_text, re.MULTILINE):
+        buckets.append((float("inf") if bound == "+Inf" else float(bound), float(count)))
+    if not buckets or buckets[-1][1] == 0:
+        return 0.0
+    total = buckets[-1][1]
+    for bound, count in buckets:
+        if count >= q * total:
+            return bound
+    return buckets[-1][0]
+
+
+def question(i: int, unique: bool) -> str:
+    text = QUESTIONS[i % len(QUESTIONS)]
+    return f"{text} (вариант {i})" if unique else text
+
+
+async def run_load(session: aiohttp.ClientSession, make_request, total: int, concurrency: int) -> Dict:
+    latencies, statuses = [], Counter()
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                status = await make_request(session, i)
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[str(status)] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": total,
+        "errors": total - statuses["200"],
+        "statuses": dict(statuses),
+        "throughput_rps": round(total / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+    }
+
+
+async def wait_replies(calls, expected: int, timeout: float, quiet: float = 1.0) -> float:
+    """Webhook отвечает сразу, ответы уходят в фоне: ждём, пока заглушка Telegram
+    получит все sendMessage и правки сообщений прекратятся"""
+    started = last_change = time.perf_counter()
+    seen = -1
+    while time.perf_counter() - started < timeout:
+        total = calls["tg.sendMessage"] + calls["tg.editMessageText"]
+        now = time.perf_counter()
+        if total != seen:
+            seen, last_change = total, now
+        elif calls["tg.sendMessage"] >= expected and now - last_change >= quiet:
+            return round(last_change - started, 2)
+        await asyncio.sleep(0.05)
+    return round(time.perf_counter() - started, 2)
+
+
+async def wait_ready(session: aiohttp.ClientSession, url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(url) as resp:
+                if resp.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"Приложение не поднялось за {timeout}с")
+
+
+async def main(args):
+    cfg = StubConfig(
+        page_size=args.page_size,
+        page_latency=args.page_latency,
+        slow_page_every=args.slow_page_every,
+        ai21_latency=args.ai21_latency,
+        ai21_tokens=args.ai21_tokens,
+    )
+    stub_runner, stub_url = await start_stubs(cfg)
+    redis_server = redis_stub = None
+    if args.state == "redis":
+        redis_server, redis_stub, state_url = await start_redis_stub()
+    elif args.state == "sqlite":
+        state_url = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="bench-state-"), "state.sqlite3")
+    else:
+        state_url = ""
+    port = free_port()
+    app_url = f"http://127.0.0.1:{port}"
+
+    env = dict(
+        os.environ,
+        PORT=str(port),
+        BOT_TOKEN="123456:BENCHMARK",
+        AI21_API_KEY="bench",
+        AI21_API_HOST=f"{stub_url}/studio/v1",
+        GOOGLE_SEARCH_URL=f"{stub_url}/search",
+        TELEGRAM_API_URL=stub_url,
+        WEBHOOK_HOST=app_url,
+        FACT_CHECK_MODE=args.fact_check,
+        TELEGRAM_EDIT_INTERVAL="0.5",
+        WEB_WORKERS=str(args.workers),
+    )
+    if state_url:
+        env["STATE_URL"] = state_url
+    log = open(args.app_log, "w") if args.app_log else subprocess.DEVNULL
+    proc = subprocess.Popen([sys.executable, "main.py"], cwd=APP_DIR, env=env, stdout=log, stderr=log)
+
+    report = {"config": vars(args), "targets": {}}
+    try:
+        connector = aiohttp.TCPConnector(limit=args.concurrency * 2)
+        timeout = aiohttp.ClientTimeout(total=args.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            # процессы стартуют параллельно, каждый со своими импортами и пулами
+            await wait_ready(session, f"{app_url}/health", timeout=30 + 15 * args.workers)
+
+            async def api_request(s, i):
+                payload = {"user_id": i % args.users, "text": question(i, args.unique), "request_id": str(i)}
+                async with s.post(f"{app_url}/api/chat", json=payload) as resp:
+                    await resp.read()
+                    return resp.status
+
+            async def webhook_request(s, i):
+                update = telegram_update(10_000 + i, 1_000 + i % args.users, question(i, args.unique))
+                async with s.post(f"{app_url}/webhook/bot", json=update) as resp:
+                    await resp.read()
+                    return resp.status
+
+            targets = {"api": api_request, "webhook": webhook_request}
+            for name in (targets if args.target == "both" else [args.target]):
+                report["targets"][name] = await run_load(session, targets[name], args.requests, args.concurrency)
+            if "webhook" in report["targets"]:
+                calls = stub_runner.app["calls"]
+                report["targets"]["webhook"]["drain_s"] = await wait_replies(calls, args.requests, args.timeout)
+                report["targets"]["webhook"]["replies"] = calls["tg.sendMessage"]
+
+            async with session.get(f"{app_url}/metrics") as resp:
+                metrics_text = await resp.text()
+        report["event_loop_lag_ms"] = {
+            "p50": histogram_quantile(metrics_text, "event_loop_lag_seconds", 0.5) * 1000,
+            "p99": histogram_quantile(metrics_text, "event_loop_lag_seconds", 0.99) * 1000,
+        }
+        report["peak_rss_mb"] = round(peak_rss_mb(proc.pid), 1)
+        report["stub_calls"] = dict(stub_runner.app["calls"])
+        if redis_stub is not None:
+            report["stub_calls"].update(redis_stub.calls)
+    finally:
+        proc.send_signal(signal.SIGINT)
+        try:
+            proc.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        await stub_runner.cleanup()
+        if redis_server is not None:
+            redis_server.close()
+            await redis_server.wait_closed()
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный бенчмарк бота с локальными заглушками")
+    parser.add_argument("--target", choices=["api", "webhook", "both"], default="both")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="запросов на каждую цель")
+    parser.add_argument("--users", type=int, default=50, help="сколько разных user_id")
+    parser.add_argument("--unique", action="store_true", help="уникальные вопросы (без попаданий в кэш)")
+    parser.add_argument("--page-size", type=int, default=100_000)
+    parser.add_argument("--page-latency", type=float, default=0.1)
+    parser.add_argument("--slow-page-every", type=int, default=0)
+    parser.add_argument("--ai21-latency", type=float, default=0.3)
+    parser.add_argument("--ai21-tokens", type=int, default=150)
+    parser.add_argument("--fact-check", default="off", choices=["off", "background", "inline"])
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--workers", type=int, default=1, help="процессов приложения (WEB_WORKERS)")
+    parser.add_argument("--state", default="", choices=["", "sqlite", "redis"],
+                        help="общее состояние процессов (по умолчанию как в приложении)")
+    parser.add_argument("--app-log", default="", help="файл для логов приложения")
+    parser.add_argument("--output", default="", help="сохранить отчёт в JSON")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,125 @@
+"""
+Микробенчмарки CPU-горячих мест: разбор HTML, очистка текста и сборка контекста.
+
+    python bench/micro.py --sizes 20000 100000 500000
+    python bench/micro.py --check   # сверка очистки текста с эталоном clean_golden.json и правил маршрутизации
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import timeit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), "app"))
+os.environ.setdefault("BOT_TOKEN", "123456:BENCHMARK")
+
+from stubs import make_page  # noqa: E402
+from services.answer_cache import answer_cache  # noqa: E402
+from services.html_extract import extract_text, shutdown_executor  # noqa: E402
+from services.memory_store import UserMemory  # noqa: E402
+from services.query_router import FOLLOW_UP, TIME, query_router  # noqa: E402
+from services.rag_system import RAGSystem  # noqa: E402
+from services.text_clean import clean_many, clean_text  # noqa: E402
+
+QUERY = "население Минска 2024"
+GOLDEN = os.path.join(BENCH_DIR, "clean_golden.json")
+# вопросы о времени: маршрут time и не кэшируются (в кэше осталось бы выдуманное время)
+TIME_QUERIES = ["Который час?", "Который сейчас час?", "Сколько время?", "Сколько сейчас времени?",
+                "Какое время?", "Время?", "Подскажите, пожалуйста, текущее время в Минске"]
+NOT_TIME_QUERIES = ["Какое время года лучше для поездки в Брест?", "Сколько времени ехать из Минска в Гродно?",
+                    "Время работы Национальной библиотеки"]
+# уточнения без поиска после PREVIOUS_QUERY и новые вопросы, которым нужен свой поиск
+PREVIOUS_QUERY = "Какое население Минска?"
+FOLLOW_UPS = ["А подробнее?", "Расскажи о нём подробнее", "А что это значит?", "Продолжи"]
+NEW_QUESTIONS = ["А какая столица Франции?", "И кто президент Польши?", "Почему небо голубое?",
+                 "А сколько стоит проезд в метро Варшавы?"]
+# пары вопросов: одинаковый ли у них ключ кэша ответов
+SAME_ANSWER = [("Где родился Франциск Скорина?", "Подскажите, пожалуйста, где родился Франциск Скорина")]
+DIFFERENT_ANSWER = [("Как доехать из Минска до Бреста?", "Как доехать до Минска из Бреста?"),
+                    ("Где родился Франциск Скорина?", "Когда родился Франциск Скорина?"),
+                    ("Можно ли въехать в Беларусь без визы?", "Можно ли въехать в Беларусь не без визы?")]
+
+
+def measure(fn, number: int) -> float:
+    """Лучшее среднее время одного вызова в миллисекундах"""
+    runs = timeit.repeat(fn, number=number, repeat=3)
+    return round(min(runs) / number * 1000, 3)
+
+
+def check_golden() -> int:
+    """Очистка должна совпадать с эталоном байт в байт"""
+    with open(GOLDEN, encoding="utf-8") as f:
+        golden = json.load(f)
+    failed = 0
+    for i, case in enumerate(golden):
+        result = clean_text(case["input"], case["max_len"])
+        if result != case["output"]:
+            failed += 1
+            print(f"#{i} max_len={case['max_len']}: {result[:80]!r} != {case['output'][:80]!r}")
+    print(f"Эталон очистки: {len(golden) - failed}/{len(golden)} совпадает")
+    return 1 if failed else 0
+
+
+def check_routing() -> int:
+    """
+    Маршрутизатор и кэш ответов должны одинаково понимать вопросы о времени, уточнения - только без новых слов,
+    а ключ кэша - различать вопросы с разным смыслом
+    """
+    failed = 0
+    for text in TIME_QUERIES + NOT_TIME_QUERIES:
+        expected = text in TIME_QUERIES
+        is_time = query_router.classify(text) == TIME
+        cached = answer_cache.key(text) is not None
+        if is_time != expected or cached == expected:
+            failed += 1
+            print(f"{text!r}: маршрут time={is_time}, в кэш={cached}, ожидалось time={expected}")
+    record = UserMemory([PREVIOUS_QUERY], last_seen=time.time())
+    for text in FOLLOW_UPS + NEW_QUESTIONS:
+        route = query_router.classify(text, record)
+        if (route == FOLLOW_UP) != (text in FOLLOW_UPS):
+            failed += 1
+            print(f"{text!r} после {PREVIOUS_QUERY!r}: маршрут {route}")
+    for a, b in SAME_ANSWER + DIFFERENT_ANSWER:
+        same = answer_cache.key(a) == answer_cache.key(b)
+        if same != ((a, b) in SAME_ANSWER):
+            failed += 1
+            print(f"{a!r} и {b!r}: одинаковый ключ кэша={same}")
+    total = (len(TIME_QUERIES) + len(NOT_TIME_QUERIES) + len(FOLLOW_UPS) + len(NEW_QUESTIONS)
+             + len(SAME_ANSWER) + len(DIFFERENT_ANSWER))
+    print(f"Правила маршрутизации и кэша ответов: {total - failed}/{total} совпадает")
+    return 1 if failed else 0
+
+
+def main(args):
+    if args.check:
+        sys.exit(check_golden() | check_routing())
+    rag = RAGSystem()
+    report = {}
+    for size in args.sizes:
+        html = make_page(size, seed=size)
+        text = extract_text(html, max_chars=size)
+        results = [{"title": f"Источник {i}", "url": f"http://example{i}.by/page",
+                    "content": extract_text(make_page(size, seed=size + i))} for i in range(5)]
+        report[size] = {
+            "extract_text_ms": measure(lambda: extract_text(html), args.number),
+            "clean_content_ms": measure(lambda: rag._clean_content(text), args.number),
+            "clean_batch_ms": measure(lambda: clean_many([r["content"] for r in results], max_len=None), args.number),
+            "format_context_ms": measure(lambda: rag._format_context(results, QUERY), args.number),
+        }
+    shutdown_executor()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Микробенчмарки разбора и очистки страниц")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20_000, 100_000, 500_000])
+    parser.add_argument("--number", type=int, default=20, help="вызовов на замер")
+    parser.add_argument("--check", action="store_true", help="только сверить очистку с эталоном и правила маршрутизации")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    main(parse_args())
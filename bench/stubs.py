@@ -0,0 +1,246 @@
+"""
+Локальные заглушки внешних сервисов для бенчмарков:
+страница выдачи Google, сайты-источники, AI21 chat completions и Telegram Bot API,
+а также минимальный Redis (RESP) для общего состояния нескольких процессов.
+"""
+import asyncio
+import json
+import random
+import time
+import zlib
+from collections import Counter
+from dataclasses import dataclass
+
+from aiohttp import web
+
+SENTENCES = [
+    "Минск — столица Республики Беларусь и крупнейший город страны.",
+    "По данным Белстата, население Минска в 2024 году составило около 1,99 млн человек.",
+    "Курс белорусского рубля устанавливается Национальным банком ежедневно.",
+    "Гомель, Могилёв, Витебск, Гродно и Брест — областные центры Беларуси.",
+    "Средняя температура января в Минске составляет около минус 5 градусов.",
+    "Национальная библиотека Беларуси открылась в новом здании 16.06.2006.",
+]
+NAV = "<nav><a href='/'>Главная</a> <a href='/news'>Новости</a> <a href='/contacts'>Контакты</a></nav>"
+
+
+@dataclass
+class StubConfig:
+    search_latency: float = 0.05     # задержка ответа Google, секунды
+    search_results: int = 8          # ссылок на странице выдачи
+    page_size: int = 100_000         # размер страницы источника, байты
+    page_latency: float = 0.1        # задержка сайта-источника
+    slow_page_every: int = 0         # каждая N-я страница отвечает в slow_page_factor раз медленнее
+    slow_page_factor: float = 20.0
+    ai21_latency: float = 0.3        # время до первого токена
+    ai21_tokens: int = 150           # длина ответа в токенах
+    ai21_token_delay: float = 0.005  # задержка между токенами при стриминге
+    telegram_latency: float = 0.02
+
+
+def make_page(size: int, seed: int = 0) -> str:
+    """HTML-страница примерно заданного размера: навигация, статья, подвал"""
+    rnd = random.Random(seed)
+    parts = ["<html><head><title>Беларусь</title><script>var x = 1;</script></head><body>", NAV, "<article>"]
+    length = sum(len(p) for p in parts)
+    while length < size:
+        paragraph = "<p>" + " ".join(rnd.choice(SENTENCES) for _ in range(5)) + "</p>"
+        parts.append(paragraph)
+        length += len(paragraph.encode("utf-8"))
+    parts.append("</article><footer>© 2024 Все права защищены</footer></body></html>")
+    return "".join(parts)
+
+
+def answer_text(tokens: int) -> str:
+    words = " ".join(SENTENCES).split()
+    return " ".join(words[i % len(words)] for i in range(tokens))
+
+
+def create_stub_app(cfg: StubConfig) -> web.Application:
+    app = web.Application()
+    calls = Counter()
+    app["calls"] = calls
+    app["config"] = cfg
+    pages = {}
+
+    async def google_search(request):
+        calls["google"] += 1
+        await asyncio.sleep(cfg.search_latency)
+        seed = zlib.crc32(request.query.get("q", "").encode()) % 10_000
+        base = f"http://{request.host}"
+        links = "".join(
+            f'<div><a href="/url?q={base}/page/{seed + i}&sa=U">Результат {i}</a></div>'
+            for i in range(cfg.search_results)
+        )
+        return web.Response(text=f"<html><body>{links}<a href='https://google.com/x'>g</a></body></html>",
+                            content_type="text/html")
+
+    async def origin_page(request):
+        calls["page"] += 1
+        page_id = int(request.match_info["page_id"])
+        delay = cfg.page_latency
+        if cfg.slow_page_every and page_id % cfg.slow_page_every == 0:
+            delay *= cfg.slow_page_factor
+        await asyncio.sleep(delay)
+        if page_id not in pages:
+            pages[page_id] = make_page(cfg.page_size, page_id)
+        return web.Response(text=pages[page_id], content_type="text/html")
+
+    async def ai21_chat(request):
+        calls["ai21"] += 1
+        body = await request.json()
+        text = answer_text(cfg.ai21_tokens)
+        usage = {"prompt_tokens": sum(len(m.get("content", "")) for m in body["messages"]) // 3,
+                 "completion_tokens": cfg.ai21_tokens, "total_tokens": 0}
+        await asyncio.sleep(cfg.ai21_latency)
+
+        if not body.get("stream"):
+            return web.json_response({
+                "id": "stub",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            chunk = {"id": "stub", "choices": [{"index": 0, "delta": {"content": word + (" " if i + 1 < len(words) else "")}}]}
+            if i + 1 == len(words):
+                chunk["usage"] = usage
+            await resp.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+            await asyncio.sleep(cfg.ai21_token_delay)
+        await resp.write(b"data: [DONE]\n\n")
+        await resp.write_eof()
+        return resp
+
+    async def telegram(request):
+        method = request.match_info["method"]
+        calls[f"tg.{method}"] += 1
+        data = await request.post()
+        await asyncio.sleep(cfg.telegram_latency)
+        if method in ("sendMessage", "editMessageText"):
+            chat_id = int(data.get("chat_id", 1))
+            result = {"message_id": int(data.get("message_id", calls[f"tg.{method}"])), "date": int(time.time()),
+                      "chat": {"id": chat_id, "type": "private"}, "text": data.get("text", "")}
+        elif method == "getWebhookInfo":
+            result = {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    app.router.add_get("/search", google_search)
+    app.router.add_get("/page/{page_id}", origin_page)
+    app.router.add_post("/studio/v1/chat/completions", ai21_chat)
+    app.router.add_post("/bot{token}/{method}", telegram)
+    return app
+
+
+def telegram_update(update_id: int, user_id: int, text: str) -> dict:
+    """Update от Telegram с текстовым сообщением"""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Load"},
+            "text": text,
+        },
+    }
+
+
+async def start_stubs(cfg: StubConfig, host: str = "127.0.0.1", port: int = 0):
+    """Запускает заглушки, возвращает (runner, base_url)"""
+    app = create_stub_app(cfg)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    real_port = runner.addresses[0][1]
+    return runner, f"http://{host}:{real_port}"
+
+
+class RedisStub:
+    """Команды Redis, которые использует RedisSharedState: GET/SET PX/DEL/INCR/PTTL/PEXPIRE"""
+
+    def __init__(self):
+        self.data = {}  # {ключ: (значение, expires или None)}
+        self.calls = Counter()
+
+    def _alive(self, key):
+        item = self.data.get(key)
+        if item is not None and item[1] is not None and item[1] < time.monotonic():
+            del self.data[key]
+            item = None
+        return item
+
+    def execute(self, name: str, args: list):
+        self.calls[f"redis.{name}"] += 1
+        if name in ("PING", "AUTH", "SELECT"):
+            return "PONG" if name == "PING" else "OK"
+        if name == "GET":
+            item = self._alive(args[0])
+            return None if item is None else item[0]
+        if name == "SET":
+            expires = None
+            if len(args) >= 4 and args[2].upper() == b"PX":
+                expires = time.monotonic() + int(args[3]) / 1000
+            self.data[args[0]] = (args[1], expires)
+            return "OK"
+        if name == "DEL":
+            return sum(self.data.pop(k, None) is not None for k in args)
+        if name == "INCR":
+            item = self._alive(args[0])
+            value = int(item[0]) + 1 if item else 1
+            self.data[args[0]] = (str(value).encode(), item[1] if item else None)
+            return value
+        if name == "PTTL":
+            item = self._alive(args[0])
+            if item is None:
+                return -2
+            return -1 if item[1] is None else int((item[1] - time.monotonic()) * 1000)
+        if name == "PEXPIRE":
+            item = self._alive(args[0])
+            if item is None:
+                return 0
+            self.data[args[0]] = (item[0], time.monotonic() + int(args[1]) / 1000)
+            return 1
+        return RuntimeError(f"ERR unknown command '{name}'")
+
+    @staticmethod
+    def encode(value) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, Exception):
+            return f"-{value}\r\n".encode()
+        if isinstance(value, int):
+            return f":{value}\r\n".encode()
+        if isinstance(value, str):
+            return f"+{value}\r\n".encode()
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                args = []
+                for _ in range(int(line[1:])):
+                    size = int((await reader.readline())[1:])
+                    args.append((await reader.readexactly(size + 2))[:-2])
+                writer.write(self.encode(self.execute(args[0].decode().upper(), args[1:])))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def start_redis_stub(host: str = "127.0.0.1", port: int = 0):
+    """Запускает заглушку Redis, возвращает (server, stub, url)"""
+    stub = RedisStub()
+    server = await asyncio.start_server(stub.handle, host, port)
+    real_port = server.sockets[0].getsockname()[1]
+    return server, stub, f"redis://{host}:{real_port}/0"
@@ -3,6 +3,7 @@ document.addEventListener("DOMContentLoaded", ()=>{
     const formInput = document.querySelector("form");
     const textArea = document.querySelector("textarea");
     const chat = document.querySelector(".chat");
+    const API_URL = "https://ai-sber.onrender.com/api/chat/stream";
     chatStory = [];
     let textInput = "";
     let hhmmTimestamp;
@@ -19,9 +20,13 @@ document.addEventListener("DOMContentLoaded", ()=>{
         hhmmTimestamp = `${formattedHours}:${formattedMinutes}`;
     }
 
-    addMessage = (whoIs, content, time) =>{
+    escapeHtml = (text) => text
+        .replace(/&/g, "&amp;")
+        .replace(/</g, "&lt;")
+        .replace(/>/g, "&gt;");
 
-        messageTemplate = `
+    renderMessage = (whoIs, content, time) =>{
+        return `
             <div class="message ${whoIs}">
                 <div>${content}</div>
                 <div class="timestamp ${whoIs}">${time}</div>
@@ -30,9 +35,60 @@ document.addEventListener("DOMContentLoaded", ()=>{
                 }
             </div>
         `
+    }
+
+    addMessage = (whoIs, content, time) =>{
+        chatStory.push(renderMessage(whoIs, escapeHtml(content), time));
+        chat.innerHTML = chatStory.join("");
+    }
 
-        chatStory.push(messageTemplate);
-        chat.innerHTML = chatStory;
+    // обновляем последнее сообщение бота по мере прихода текста
+    updateLastMessage = (whoIs, content, time) =>{
+        chatStory[chatStory.length - 1] = renderMessage(whoIs, escapeHtml(content), time);
+        chat.innerHTML = chatStory.join("");
+        chat.scrollTo(0, chat.scrollHeight);
+    }
+
+    // читаем ответ /api/chat/stream (Server-Sent Events поверх POST)
+    streamAnswer = async (text, time) =>{
+        const userId = window.Telegram?.WebApp?.initDataUnsafe?.user?.id;
+        let answer = "";
+        addMessage("bot", "…", time);
+
+        try {
+            const response = await fetch(API_URL, {
+                method: "POST",
+                headers: {"Content-Type": "application/json"},
+                body: JSON.stringify({user_id: userId, text: text})
+            });
+            if (response.status == 429 || response.status == 503) {
+                const retryAfter = response.headers.get("Retry-After") || "несколько";
+                updateLastMessage("bot", `⏳ Слишком много запросов. Повторите через ${retryAfter} с.`, time);
+                return;
+            }
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = "";
+
+            while (true) {
+                const {done, value} = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, {stream: true});
+
+                const events = buffer.split("\n\n");
+                buffer = events.pop();
+                for (const raw of events) {
+                    const event = raw.match(/^event: (.*)$/m)?.[1];
+                    const data = JSON.parse(raw.match(/^data: (.*)$/m)?.[1] || "{}");
+                    if (event == "delta") answer += data.text;
+                    if (event == "done") answer = data.answer;
+                    if (event == "error") answer = "❌ Ошибка API. Попробуйте позже.";
+                    updateLastMessage("bot", answer, time);
+                }
+            }
+        } catch (e) {
+            updateLastMessage("bot", "❌ Не удалось соединиться с сервером.", time);
+        }
     }
 
     textArea.addEventListener("change", (e)=>{
@@ -43,7 +99,7 @@ document.addEventListener("DOMContentLoaded", ()=>{
         e.preventDefault();
         getTime();
         addMessage("user", textInput, hhmmTimestamp);
-        addMessage("bot", textInput, hhmmTimestamp);
+        streamAnswer(textInput, hhmmTimestamp);
         chat.scrollTo(0, document.body.scrollHeight);
     })
     